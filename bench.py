@@ -0,0 +1,232 @@
+"""
+Seeded benchmarks of the hot paths: the hand predicates and showdown, the card features and decision of
+Player.decide, training, the time from import to the first hand, and whole hands of heads up and 6-max self-play.
+Every workload is built from a fixed seed, and the models used by the self-play benchmarks are trained from seeded
+data by the benchmark itself, so results only depend on the code.
+
+    python bench.py --output before.json
+    python bench.py --baseline before.json --max-slowdown 0.2
+
+Results are written as JSON. With --baseline, the run fails (exit status 1) if any benchmark is more than
+--max-slowdown slower than in the baseline file.
+"""
+from items import *
+from features import BOARD_CACHE, HAND_CACHE, preflop_features, postflop_features
+from simulator import Simulator
+import learning
+import game
+import argparse
+import json
+import os
+import platform
+import random as rn
+import subprocess
+import sys
+import time
+import numpy as np
+
+BENCH_DATA_NAME = 'bench'
+BENCH_MODEL_FOLDER = './models/bench_'
+PREDICATES = [('is_oak_2', lambda hand: hand.is_oak(2)),
+              ('is_oak_3', lambda hand: hand.is_oak(3)),
+              ('is_oak_4', lambda hand: hand.is_oak(4)),
+              ('is_two_pair', lambda hand: hand.is_two_pair()),
+              ('is_full_house', lambda hand: hand.is_full_house()),
+              ('is_straight', lambda hand: hand.is_straight()),
+              ('is_flush', lambda hand: hand.is_flush()),
+              ('is_straight_flush', lambda hand: hand.is_straight_flush()),
+              ('made_hands', lambda hand: hand.made_hands())]
+
+
+def best_time(function, repeat):
+    """
+    :param function: function of no arguments
+    :param repeat: int
+    :return: float. The fastest of repeat calls, in seconds
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def seven_card_hands(n, seed):
+    """
+    :return: list of n Hands of 7 cards
+    """
+    deck = Deck(seed=seed)
+    hands = []
+    for i in range(n):
+        deck.shuffle()
+        hands.append(Hand(deck.draw(7)))
+    return hands
+
+
+def decision_points(n, seed):
+    """
+    :return: list of n (hole cards, board || None), evenly spread over the streets
+    """
+    deck = Deck(seed=seed)
+    points = []
+    for i in range(n):
+        deck.shuffle()
+        hole = Hand(deck.draw(2))
+        board_size = learning.BOARD_SIZES[i % len(learning.BOARD_SIZES)]
+        points.append((hole, Hand(deck.draw(board_size)) if board_size else None))
+    return points
+
+
+def card_features(points):
+    """
+    The card part of Player.decide, from cold feature caches
+    """
+    BOARD_CACHE.clear()
+    HAND_CACHE.clear()
+    for hole, board in points:
+        preflop_features(hole)
+        if board is not None:
+            postflop_features(hole, board)
+
+
+def startup_latency():
+    """
+    :return: float. Seconds from the first import to the end of the first hand, in a new interpreter
+    """
+    script = 'import time\nstart = time.time()\nimport game\ngame.start_games(1)\nprint time.time() - start'
+    return float(subprocess.check_output([sys.executable, '-c', script]).split()[-1])
+
+
+def train_bench_models(data_name):
+    for name in learning.STREETS:
+        learning.train_model(name, data_name)
+
+
+def run(scale=1., repeat=3, seed=0):
+    """
+    Run every benchmark
+    :param scale: float. Multiplies the size of every workload
+    :param repeat: int. Each benchmark is timed this many times and the fastest time is kept
+    :param seed: int
+    :return: dict. For every benchmark, the number of operations, the seconds they took and operations per second
+    """
+    results = {}
+
+    def record(name, ops, seconds):
+        results[name] = {'ops': ops, 'seconds': seconds, 'per_second': ops / seconds}
+        print '{:<20}{:>12.0f}/s'.format(name, ops / seconds)
+
+    record('startup', 1, min([startup_latency() for i in range(repeat)]))
+
+    n = int(2000 * scale)
+    hands = seven_card_hands(2 * n, seed)
+    pairs = zip(hands[:n], hands[n:])
+    record('showdown', n, best_time(lambda: [mine.showdown(yours) for mine, yours in pairs], repeat))
+    for name, predicate in PREDICATES:
+        record(name, len(hands), best_time(lambda: [predicate(hand) for hand in hands], repeat))
+
+    points = decision_points(n, seed)
+    record('decide_features', n, best_time(lambda: card_features(points), repeat))
+
+    # Seeded training data from random play. The benchmark's models are kept apart from the real ones
+    model_folder = learning.model_folder
+    learning.model_folder = BENCH_MODEL_FOLDER
+    try:
+        folder = os.path.dirname(BENCH_MODEL_FOLDER)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        recorder = learning.Recorder(BENCH_DATA_NAME)
+        Simulator(1024, models=[None] * 4, recorder=recorder, randomness=1., seed=seed).run(int(10000 * scale))
+        recorder.flush()
+        record('train_model', recorder.count, best_time(lambda: train_bench_models(BENCH_DATA_NAME), repeat))
+        models = learning.load_all_models()
+    finally:
+        learning.model_folder = model_folder
+
+    width, data = learning.load_split(BENCH_DATA_NAME, learning.RIVER_NAME)
+    x = np.vstack([np.hstack((np.full((len(x), 1), decision), x))
+                   for decision, (x, y) in sorted(data.items())])
+    x = x[np.arange(n) % len(x)]
+    record('decision_parameter', len(x),
+           best_time(lambda: [learning.decision_parameter(row, models[3]) for row in x], repeat))
+
+    # Whole hands between the benchmark's models
+    game.load_models()
+    saved = game.preflop_model, game.flop_model, game.turn_model, game.river_model
+    game.preflop_model, game.flop_model, game.turn_model, game.river_model = models
+    try:
+        hands_played = int(500 * scale)
+
+        def play(number_of_players):
+            rn.seed(seed)
+            game.start_games(hands_played, number_of_players=number_of_players)
+        record('hands', hands_played, best_time(lambda: play(2), repeat))
+        record('hands_6max', hands_played, best_time(lambda: play(6), repeat))
+
+        hands_played = int(20000 * scale)
+        record('simulator_hands', hands_played,
+               best_time(lambda: Simulator(4096, models=models, seed=seed).run(hands_played), repeat))
+    finally:
+        game.preflop_model, game.flop_model, game.turn_model, game.river_model = saved
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results, baseline, max_slowdown):
+    """
+    :param results: dict. As returned by run
+    :param baseline: dict. As returned by run
+    :param max_slowdown: float. Allowed fractional increase in time per operation
+    :return: list of strings. One line per benchmark that got too slow
+    """
+    lines = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        slowdown = baseline[name]['per_second'] / results[name]['per_second'] - 1
+        if slowdown > max_slowdown:
+            lines.append('{}: {:.0f}/s, was {:.0f}/s ({:+.0%})'.format(
+                name, results[name]['per_second'], baseline[name]['per_second'], slowdown))
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the poker engine')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help='fail if a benchmark takes this fraction longer than in the baseline')
+    parser.add_argument('--scale', type=float, default=1., help='multiplies the size of every workload')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = {'commit': git_commit(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'scale': args.scale,
+              'seed': args.seed,
+              'results': run(args.scale, args.repeat, args.seed)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = regressions(report['results'], baseline['results'], args.max_slowdown)
+        if failures:
+            print 'Slower than {}:'.format(args.baseline)
+            for line in failures:
+                print '\t' + line
+            sys.exit(1)
+        print 'No benchmark is more than {:.0%} slower than {}'.format(args.max_slowdown, args.baseline)
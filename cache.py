@@ -0,0 +1,58 @@
+"""
+Versioned on-disk cache for precomputed tables.
+
+A table is built once, saved as a .npy file and from then on memory-mapped read-only with np.load(mmap_mode='r'), so
+worker processes share the same pages instead of each building their own copy. The file name holds the table's
+version, which is bumped whenever the code that builds it changes, so a stale table is never read. Files are written
+under a temporary name and renamed into place, so processes racing to build the same table never see a partial file.
+"""
+import numpy as np
+import os
+
+CACHE_FOLDER = './cache/'
+
+
+def cache_path(name, version):
+    """
+    :param name: String
+    :param version: int
+    :return: String. Where version `version` of table `name` is kept
+    """
+    return os.path.join(CACHE_FOLDER, '{}.v{}.npy'.format(name, version))
+
+
+def cached_table(name, version, build):
+    """
+    Load a table from the cache, building and saving it first if it is missing or stale
+    :param name: String
+    :param version: int. Bump when build changes what it returns
+    :param build: function of no arguments that returns an np.array
+    :return: np.array. Read-only. A plain ndarray view of the memory map, which indexes faster than np.memmap
+    """
+    path = cache_path(name, version)
+    if os.path.exists(path):
+        return np.asarray(np.load(path, mmap_mode='r'))
+
+    table = np.asarray(build())
+    if not os.path.isdir(CACHE_FOLDER):
+        try:
+            os.makedirs(CACHE_FOLDER)
+        except OSError:  # made by another process in the meantime
+            pass
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as out:
+        np.save(out, table)
+    os.rename(temporary, path)
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+def clear(name=None):
+    """
+    Delete cached tables, every version
+    :param name: String. Only this table. Defaults to all of them
+    """
+    if not os.path.isdir(CACHE_FOLDER):
+        return
+    for file_name in os.listdir(CACHE_FOLDER):
+        if name is None or file_name.startswith(name + '.v'):
+            os.remove(os.path.join(CACHE_FOLDER, file_name))
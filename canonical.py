@@ -0,0 +1,155 @@
+"""
+Suit isomorphism. Two sets of cards that only differ by a renaming of the suits play the same: AhKh7c with QdJd on
+the flop is AsKs7d with QcJc. Cards are described suit by suit, as the 13-bit value masks of the hole cards and of the
+board in that suit, and the description of every suit is sorted. Isomorphic hands get the same sorted description,
+which is packed into an integer key, so caches, equity tables and data sets can be keyed by the class instead of the
+exact cards.
+
+Boards (and any set of cards) also get a dense index per size, from precomputed tables kept in the on-disk cache.
+Preflop, (hole, board) has a dense index too: the 169 starting hands, numbered as features.PREFLOP_CLASSES.
+"""
+from items import *
+from cache import cached_table
+from itertools import chain, combinations
+import numpy as np
+
+TABLES_VERSION = 1
+BOARD_CLASSES = {0: 1, 1: 13, 2: 169, 3: 1755, 4: 16432, 5: 134459}  # classes of each size of card set
+_board_tables = {}
+
+
+def canonical_mask(card_nums):
+    """
+    Key of a set of cards up to suit isomorphism: the value masks of the four suits, sorted, packed into 52 bits
+    :param card_nums: iterable of ints
+    :return: int
+    """
+    return canonical_suit_masks(suit_masks(card_nums))
+
+
+def canonical_suit_masks(masks):
+    """
+    canonical_mask of a set of cards given as its suit masks, e.g. the suit masks of two sets OR'd together
+    :param masks: list of 4 ints, see suit_masks
+    :return: int
+    """
+    first, second, third, fourth = sorted(masks, reverse=True)
+    return first << 39 | second << 26 | third << 13 | fourth
+
+
+def canonical_key(hole, board=()):
+    """
+    Key of hole cards on a board up to suit isomorphism. Suits are sorted by (hole cards, board cards) in the suit
+    :param hole: iterable of card_nums
+    :param board: iterable of card_nums
+    :return: int (up to 104 bits)
+    """
+    hole_masks = suit_masks(hole)
+    board_masks = suit_masks(board)
+    pairs = sorted([hole_masks[suit] << 13 | board_masks[suit] for suit in range(4)], reverse=True)
+    return pairs[0] << 78 | pairs[1] << 52 | pairs[2] << 26 | pairs[3]
+
+
+def canonicalize(hole, board=()):
+    """
+    A representative of the class of (hole, board): suits are renamed so that the suit that sorts first in
+    canonical_key becomes suit 0, and so on. Isomorphic inputs give the same output
+    :param hole: iterable of card_nums
+    :param board: iterable of card_nums
+    :return: (list of card_nums, list of card_nums). Hole cards and board, each in descending order
+    """
+    hole_masks = suit_masks(hole)
+    board_masks = suit_masks(board)
+    order = sorted(range(4), key=lambda suit: hole_masks[suit] << 13 | board_masks[suit], reverse=True)
+    rename = [0] * 4
+    for new_suit, suit in enumerate(order):
+        rename[suit] = new_suit
+    return (sorted([card_num & ~3 | rename[card_num & 3] for card_num in hole], reverse=True),
+            sorted([card_num & ~3 | rename[card_num & 3] for card_num in board], reverse=True))
+
+
+def preflop_index(hole):
+    """
+    Dense index of two hole cards up to suit isomorphism. high * 13 + low if suited, low * 13 + high if not, so pocket
+    pairs are value * 14
+    :param hole: two card_nums
+    :return: int in range(169)
+    """
+    first, second = hole
+    high, low = max(first, second) >> 2, min(first, second) >> 2
+    if (first & 3) == (second & 3):
+        return high * 13 + low
+    return low * 13 + high
+
+
+def _canonical_masks(cards):
+    """
+    canonical_mask of many sets of cards at once
+    :param cards: int array of shape (N, k)
+    :return: int64 array of shape (N,)
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    bits = 1 << (cards >> 2)
+    masks = np.sort(np.array([np.where(cards & 3 == suit, bits, 0).sum(axis=1) for suit in range(4)]).T, axis=1)
+    return masks[:, 3] << 39 | masks[:, 2] << 26 | masks[:, 1] << 13 | masks[:, 0]
+
+
+def _build_board_table(size):
+    if size == 0:
+        return np.zeros(1, dtype=np.int64)
+    cards = np.fromiter(chain.from_iterable(combinations(range(52), size)), dtype=np.int8).reshape(-1, size)
+    return np.unique(_canonical_masks(cards))
+
+
+def board_table(size):
+    """
+    Every class of card sets of a size, by canonical_mask. Built the first time it is needed, then read from the cache
+    :param size: int in range(6)
+    :return: sorted int64 array of shape (BOARD_CLASSES[size],)
+    """
+    table = _board_tables.get(size)
+    if table is None:
+        table = cached_table('canonical_boards_{}'.format(size), TABLES_VERSION, lambda: _build_board_table(size))
+        _board_tables[size] = table
+    return table
+
+
+def board_index(board):
+    """
+    Dense index of a board (or any set of up to 5 cards) up to suit isomorphism
+    :param board: list of card_nums
+    :return: int in range(BOARD_CLASSES[len(board)])
+    """
+    return int(np.searchsorted(board_table(len(board)), canonical_mask(board)))
+
+
+if __name__ == '__main__':
+    import time
+
+    for size in range(6):
+        start = time.time()
+        table = board_table(size)
+        assert len(table) == BOARD_CLASSES[size]
+        print '{} card sets: {} classes ({:.1f}s)'.format(size, len(table), time.time() - start)
+
+    # Keys and indices are unchanged by any renaming of the suits, and canonicalize lands on the same cards
+    from itertools import permutations
+    deck = Deck(seed=0)
+    for i in range(2000):
+        deck.shuffle()
+        hole = [card.card_num for card in deck.draw(2)]
+        board = [card.card_num for card in deck.draw(i % 6)]
+        for rename in permutations(range(4)):
+            other_hole = [card_num & ~3 | rename[card_num & 3] for card_num in hole]
+            other_board = [card_num & ~3 | rename[card_num & 3] for card_num in board]
+            assert canonical_key(hole, board) == canonical_key(other_hole, other_board)
+            assert canonicalize(hole, board) == canonicalize(other_hole, other_board)
+            assert board_index(board) == board_index(other_board)
+            assert preflop_index(hole) == preflop_index(other_hole)
+    print 'Suit renamings agree'
+
+    # Every flop deal of one starting hand: the classes a cache keyed by canonical_key has to hold
+    hole = [48, 44]  # AK suited
+    deals = [board for board in combinations([card_num for card_num in range(52) if card_num not in hole], 3)]
+    classes = set([canonical_key(hole, board) for board in deals])
+    print 'AK suited: {} flops, {} classes'.format(len(deals), len(classes))
@@ -0,0 +1,250 @@
+"""
+Win probability of a hand against a random opponent hand, or against known hands.
+
+On the river the answer is enumerated exactly: every possible opponent hand is evaluated. Ranks of all 1326 opponent
+hands on a complete board are cached per board, so repeated queries on the same board only cost a few array operations.
+Earlier streets are Monte Carlo'd with the batch evaluator, and equity_batch ranks the samples of many queries together.
+An exact turn answer ranks every opponent hand on every river, about 45000 evaluations on a fresh board, so the turn is
+only enumerated when max_enumeration is raised to EXACT_TURN. Against known hands only the runouts are left to deal, so
+those are enumerated from the flop on.
+"""
+from items import *
+from evaluator import evaluate, evaluate_batch
+from itertools import combinations
+import numpy as np
+
+PAIRS = np.array(list(combinations(range(52), 2)))  # every pair of hole cards, shape (1326, 2)
+_PAIR_CARDS = np.zeros((len(PAIRS), 52), dtype=bool)  # which cards each pair holds
+_PAIR_CARDS[np.arange(len(PAIRS)), PAIRS[:, 0]] = True
+_PAIR_CARDS[np.arange(len(PAIRS)), PAIRS[:, 1]] = True
+
+MAX_CACHED_BOARDS = 1024
+BATCH_ROWS = 1 << 14  # Monte Carlo samples ranked per evaluate_batch call by equity_batch
+MAX_ENUMERATION = 5000  # equity enumerates the river (about 1000 combinations) and samples earlier streets
+EXACT_TURN = 50000  # a max_enumeration that enumerates the turn too
+_board_ranks_cache = {}
+
+
+def card_nums_of(cards):
+    """
+    :param cards: Hand, list of Cards, list of card_nums or None
+    :return: list of card_nums
+    """
+    if cards is None:
+        return []
+    if isinstance(cards, Hand):
+        return cards.card_nums()
+    return [card.card_num if isinstance(card, Card) else int(card) for card in cards]
+
+
+def board_ranks(board):
+    """
+    The rank of every pair of hole cards on a complete board. Cached per board
+    :param board: list of 5 card_nums
+    :return: array of shape (1326,), -1 for pairs that hold a board card. Index like PAIRS
+    """
+    ranks = _board_ranks_cache.get(nums_to_mask(board))
+    if ranks is None:
+        ranks = _board_ranks_many(np.array([board], dtype=np.int64))[0]
+    return ranks
+
+
+def _board_ranks_many(boards):
+    """
+    board_ranks of many complete boards, ranking every board missing from the cache in one evaluate_batch call
+    :param boards: int array of shape (N, 5)
+    :return: array of shape (N, 1326)
+    """
+    keys = [nums_to_mask(board) for board in boards.tolist()]
+    ranks = -np.ones((len(boards), len(PAIRS)), dtype=np.int64)
+    missing = []
+    for i, key in enumerate(keys):
+        cached = _board_ranks_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            ranks[i] = cached
+    if missing:
+        possible = ~_PAIR_CARDS[:, boards[missing]].any(axis=2).T
+        rows = np.hstack((np.tile(PAIRS, (len(missing), 1)), np.repeat(boards[missing], len(PAIRS), axis=0)))
+        new_ranks = -np.ones(possible.shape, dtype=np.int64)
+        new_ranks[possible] = evaluate_batch(rows[possible.ravel()])
+        ranks[missing] = new_ranks
+        if len(_board_ranks_cache) + len(missing) > MAX_CACHED_BOARDS:
+            _board_ranks_cache.clear()
+        for i in missing:
+            _board_ranks_cache[keys[i]] = ranks[i]
+    return ranks
+
+
+def _enumerate(hole, board, rest):
+    """
+    Exact equity against a random hand: every runout from rest, and on each every opponent pair of the cards left
+    """
+    available = np.zeros(52, dtype=bool)
+    available[rest] = True
+    if len(board) == 5:
+        opponents = board_ranks(board)
+        mine = evaluate(hole + board)
+    else:
+        to_deal = 5 - len(board)
+        runouts = list(combinations(rest, to_deal))
+        runouts = np.array(runouts, dtype=np.int64).reshape(len(runouts), to_deal)
+        boards = np.hstack((np.tile(board, (len(runouts), 1)).reshape(len(runouts), len(board)), runouts))
+        opponents = _board_ranks_many(boards)  # -1 for the pairs that hold a card of the runout
+        mine = evaluate_batch(np.hstack((np.tile(hole, (len(boards), 1)), boards)))[:, None]
+    possible = (available[PAIRS[:, 0]] & available[PAIRS[:, 1]]) & (opponents >= 0)
+    wins = ((mine > opponents) & possible).sum()
+    ties = ((mine == opponents) & possible).sum()
+    return (wins + 0.5 * ties) / float(possible.sum()), 0.
+
+
+def _sample(decks, rows, k, rng):
+    """
+    Draw k different cards for each of many samples. Draw i is a uniform index among the n - i cards not drawn yet,
+    turned into an index into the deck by stepping over the earlier draws in increasing order
+    :param decks: int array of shape (Q, n). The cards left in each deck
+    :param rows: int array of shape (N,). The deck each sample draws from
+    :param k: int
+    :param rng: np.random.RandomState
+    :return: int array of shape (N, k). Every row in drawing order
+    """
+    n = decks.shape[1]
+    indices = []
+    ascending = []  # the draws so far, sorted within every sample
+    for i in range(k):
+        index = (rng.rand(len(rows)) * (n - i)).astype(np.int64)
+        for drawn in ascending:
+            index += index >= drawn
+        indices.append(index)
+        carry = index
+        for j, drawn in enumerate(ascending):
+            ascending[j] = np.minimum(drawn, carry)
+            carry = np.maximum(drawn, carry)
+        ascending.append(carry)
+    return decks[rows[:, None], np.array(indices).T]
+
+
+def equity_batch(holes, boards=None, dead=None, samples=2000, rng=None):
+    """
+    Monte Carlo equity of many hands at once, each against one random hand. The samples of many queries are ranked by
+    the same evaluate_batch call, BATCH_ROWS at a time
+    :param holes: int array of shape (N, 2). card_nums of the hole cards
+    :param boards: int array of shape (N, board size) || None. card_nums of the boards, all of the same size
+    :param dead: list of card_nums. Out of play in every query
+    :param samples: int. Runouts per query
+    :param rng: np.random.RandomState. Defaults to the global numpy RNG
+    :return: (array of shape (N,), array of shape (N,)). Equities and their standard errors
+    """
+    holes = np.asarray(holes, dtype=np.int64).reshape(-1, 2)
+    n = len(holes)
+    boards = np.zeros((n, 0), dtype=np.int64) if boards is None else np.asarray(boards, dtype=np.int64).reshape(n, -1)
+    rng = np.random if rng is None else rng
+    used = np.zeros((n, 52), dtype=bool)
+    used[np.arange(n)[:, None], np.hstack((holes, boards))] = True
+    used[:, card_nums_of(dead)] = True
+    rest = np.nonzero(~used)[1].reshape(n, -1)  # the cards left in every deck, in order
+    to_deal = 7 - boards.shape[1]  # the rest of the board, then the opponent's two cards
+
+    equities = np.zeros(n)
+    errors = np.zeros(n)
+    per_block = max(1, BATCH_ROWS // samples)
+    for start in range(0, n, per_block):
+        stop = min(start + per_block, n)
+        picks = _sample(rest, np.repeat(np.arange(start, stop), samples), to_deal, rng)
+        full_board = np.hstack((np.repeat(boards[start:stop], samples, axis=0), picks[:, :-2]))
+        mine = evaluate_batch(np.hstack((np.repeat(holes[start:stop], samples, axis=0), full_board)))
+        yours = evaluate_batch(np.hstack((picks[:, -2:], full_board)))
+        outcomes = ((mine > yours) + 0.5 * (mine == yours)).reshape(stop - start, samples)
+        equities[start:stop] = outcomes.mean(axis=1)
+        errors[start:stop] = outcomes.std(axis=1) / np.sqrt(samples)
+    return equities, errors
+
+
+def _runouts(board, rest, samples, max_enumeration, rng):
+    """
+    :return: (int array of shape (runouts, 5 - len(board)), Bool). Every way to complete the board from rest if there
+    are at most max_enumeration, else samples random ones. The Bool tells if they were enumerated
+    """
+    to_deal = 5 - len(board)
+    combos = 1
+    for i in range(to_deal):
+        combos = combos * (len(rest) - i) // (i + 1)
+    if combos <= max_enumeration:
+        return np.array(list(combinations(rest, to_deal)), dtype=np.int64).reshape(combos, to_deal), True
+    decks = np.array([rest], dtype=np.int64)
+    return _sample(decks, np.zeros(samples, dtype=np.int64), to_deal, np.random if rng is None else rng), False
+
+
+def runout_ranks(holes, board=None, dead=None, samples=2000, max_enumeration=50000, rng=None):
+    """
+    The rank of each of several known hands on every way to complete the board. Runouts are enumerated if there are
+    at most max_enumeration of them, else Monte Carlo'd
+    :param holes: list of Hands, lists of Cards or lists of card_nums. Two hole cards per player
+    :param board: same types. 0 to 5 board cards
+    :param dead: same types. Cards known to be out of play
+    :param samples: int. Monte Carlo runouts when enumerating is not feasible
+    :param max_enumeration: int
+    :param rng: np.random.RandomState. Defaults to the global numpy RNG
+    :return: (int array of shape (runouts, players), Bool). The ranks, as evaluate's, and whether they were enumerated
+    """
+    holes = [card_nums_of(hole) for hole in holes]
+    board = card_nums_of(board)
+    used = nums_to_mask(sum(holes, []) + board + card_nums_of(dead))
+    rest = [card_num for card_num in range(52) if not used >> card_num & 1]
+    runouts, exact = _runouts(board, rest, samples, max_enumeration, rng)
+    full_board = np.hstack((np.tile(board, (len(runouts), 1)).reshape(len(runouts), len(board)), runouts))
+    ranks = np.vstack([evaluate_batch(np.hstack((np.tile(hole, (len(runouts), 1)), full_board))) for hole in holes])
+    return ranks.T, exact
+
+
+def equity(hole, board=None, dead=None, samples=2000, max_enumeration=MAX_ENUMERATION, rng=None, opponent=None):
+    """
+    Heads up all-in equity against one random hand: the probability of winning plus half the probability of a tie
+    :param hole: Hand, list of Cards or list of card_nums. Two hole cards
+    :param board: same types. 0 to 5 board cards
+    :param dead: same types. Cards known to be out of play
+    :param samples: int. Monte Carlo runouts when enumerating is not feasible
+    :param max_enumeration: int. Enumerate exactly if there are at most this many (runout, opponent hand) combinations,
+    or runouts with a known opponent. EXACT_TURN enumerates the turn, at under 200 queries/s on fresh boards
+    :param rng: np.random.RandomState. Defaults to the global numpy RNG
+    :param opponent: same types. The opponent's hole cards, if known. Then only the runouts are enumerated or sampled
+    :return: (equity, standard error). The standard error is 0 when enumerated
+    """
+    if opponent is not None:
+        ranks, exact = runout_ranks([hole, opponent], board, dead, samples, max_enumeration, rng)
+        outcomes = (ranks[:, 0] > ranks[:, 1]) + 0.5 * (ranks[:, 0] == ranks[:, 1])
+        return outcomes.mean(), 0. if exact else outcomes.std() / np.sqrt(len(outcomes))
+
+    hole = card_nums_of(hole)
+    board = card_nums_of(board)
+    used = nums_to_mask(hole + board + card_nums_of(dead))
+    rest = [card_num for card_num in range(52) if not used >> card_num & 1]
+
+    to_deal = 5 - len(board)
+    combos = 1
+    for i in range(to_deal):
+        combos = combos * (len(rest) - i) // (i + 1)
+    combos *= (len(rest) - to_deal) * (len(rest) - to_deal - 1) // 2
+    if combos <= max_enumeration:
+        return _enumerate(hole, board, rest)
+    equities, errors = equity_batch([hole], [board], card_nums_of(dead), samples, rng)
+    return equities[0], errors[0]
+
+
+if __name__ == '__main__':
+    import time
+
+    deck = Deck()
+    queries = 100
+    for street, max_enumeration in ((0, MAX_ENUMERATION), (3, MAX_ENUMERATION), (4, MAX_ENUMERATION), (4, EXACT_TURN),
+                                    (5, MAX_ENUMERATION)):
+        deals = []
+        for i in range(queries):  # a fresh deal for every query, so no board is ranked from the cache
+            deck.shuffle()
+            deals.append((deck.draw(2), deck.draw(street)))
+        start = time.time()
+        for hole, board in deals:
+            result = equity(hole, board, max_enumeration=max_enumeration)
+        print 'Board of {}, max_enumeration {}: equity {:.3f} +- {:.3f}, {:.0f} queries/s'.format(
+            street, max_enumeration, result[0], result[1], queries / (time.time() - start))
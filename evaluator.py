@@ -0,0 +1,262 @@
+"""
+Precomputed hand evaluator.
+
+Every hand of up to 7 cards is mapped to a single integer rank. A higher rank is a better hand, equal ranks are a tie.
+Cards are plain card numbers (see items.Card): value, suit = divmod(card_num, 4).
+
+Ranks are packed as category << 20 followed by up to five 4-bit card values (the values that decide ties, most
+significant first). Flushes are looked up by the 13-bit value mask of the flushing suit, every other hand by the
+product of one prime per card value (Cactus Kev style), so there is no best-of-21 loop over 5 card subsets.
+evaluate_batch indexes 7 card hands directly by a sum of per-value keys instead, which avoids searching the products.
+
+The tables are kept in the on-disk cache (see cache.py), so they are only built the first time.
+"""
+from cache import cached_table
+import numpy as np
+
+HIGH_CARD = 0
+PAIR = 1
+TWO_PAIR = 2
+THREE_OF_A_KIND = 3
+STRAIGHT = 4
+FLUSH = 5
+FULL_HOUSE = 6
+FOUR_OF_A_KIND = 7
+STRAIGHT_FLUSH = 8
+
+CATEGORY_NAMES = ['High Card', 'Pair', 'Two Pair', 'Three of a Kind', 'Straight', 'Flush', 'Full House',
+                  'Four of a Kind', 'Straight Flush']
+
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]  # one per value, '2' through 'A'
+# One per value, '2' through 'A'. The sums of the keys of 7 values, at most 4 of each, are all different
+SEVEN_CARD_KEYS = [0, 1, 5, 22, 98, 453, 2031, 8698, 22854, 83661, 262349, 636345, 1479181]
+MAX_CARDS = 7
+TABLES_VERSION = 1  # bump whenever the ranks change
+
+
+def _pack(category, values):
+    """
+    Pack a category and its tie breaking values into a rank
+    :param category: int. One of the category constants above
+    :param values: list of ints. At most 5 card values, most significant first
+    :return: int
+    """
+    rank = category << 20
+    for i, value in enumerate(values):
+        rank |= value << (16 - 4 * i)
+    return rank
+
+
+def _top_values(mask, k):
+    """
+    The k highest values in a 13-bit value mask, in descending order
+    :param mask: int
+    :param k: int
+    :return: list of ints (shorter than k if the mask has fewer bits)
+    """
+    values = []
+    for value in range(12, -1, -1):
+        if len(values) == k:
+            break
+        if mask >> value & 1:
+            values.append(value)
+    return values
+
+
+def _straight_high(mask):
+    """
+    The value of the top card of the highest straight in a 13-bit value mask. The wheel (A-2-3-4-5) is a 5 high straight
+    :param mask: int
+    :return: int. -1 if there is no straight
+    """
+    for high in range(12, 3, -1):
+        pattern = 0x1F << (high - 4)
+        if mask & pattern == pattern:
+            return high
+    wheel = 0x100F  # A, 2, 3, 4, 5
+    if mask & wheel == wheel:
+        return 3
+    return -1
+
+
+def _flush_rank(mask):
+    if bin(mask).count('1') < 5:
+        return 0
+    high = STRAIGHT_HIGH[mask]
+    if high >= 0:
+        return _pack(STRAIGHT_FLUSH, [high])
+    return _pack(FLUSH, _top_values(mask, 5))
+
+
+def _rank_of_counts(counts):
+    """
+    Rank of a hand that is not a flush, given how many cards of each value it holds
+    :param counts: list of 13 ints
+    :return: int
+    """
+    mask = 0
+    for value, count in enumerate(counts):
+        if count:
+            mask |= 1 << value
+    groups = sorted([(count, value) for value, count in enumerate(counts) if count], reverse=True)
+    count, value = groups[0]
+    second = groups[1] if len(groups) > 1 else (0, 0)
+    rest = mask & ~(1 << value)
+
+    if count == 4:
+        return _pack(FOUR_OF_A_KIND, [value] + _top_values(rest, 1))
+    if count == 3 and second[0] >= 2:
+        return _pack(FULL_HOUSE, [value, second[1]])
+    if STRAIGHT_HIGH[mask] >= 0:
+        return _pack(STRAIGHT, [STRAIGHT_HIGH[mask]])
+    if count == 3:
+        return _pack(THREE_OF_A_KIND, [value] + _top_values(rest, 2))
+    if count == 2 and second[0] == 2:
+        return _pack(TWO_PAIR, [value, second[1]] + _top_values(rest & ~(1 << second[1]), 1))
+    if count == 2:
+        return _pack(PAIR, [value] + _top_values(rest, 3))
+    return _pack(HIGH_CARD, _top_values(mask, 5))
+
+
+def _all_counts(total, value=0):
+    """
+    Generate every way of holding `total` cards across the values value..12 (at most 4 of each)
+    """
+    if value == 12:
+        if total <= 4:
+            yield [total]
+        return
+    for count in range(min(total, 4) + 1):
+        for tail in _all_counts(total - count, value + 1):
+            yield [count] + tail
+
+
+def _product_ranks():
+    """
+    :return: np.array of shape (2, number of rank multisets). The prime product of every multiset of 1 to MAX_CARDS
+    values, and the rank of a hand that holds them and no flush
+    """
+    products = []
+    ranks = []
+    for total in range(1, MAX_CARDS + 1):
+        for counts in _all_counts(total):
+            product = 1
+            for value, count in enumerate(counts):
+                product *= PRIMES[value] ** count
+            products.append(product)
+            ranks.append(_rank_of_counts(counts))
+    return np.array([products, ranks], dtype=np.int64)
+
+
+def _seven_card_ranks():
+    """
+    :return: np.array of shape (largest key sum + 1,). The rank of a 7 card hand without a flush, indexed by the sum
+    of the SEVEN_CARD_KEYS of its values. A direct index rather than a search, for evaluate_batch
+    """
+    sums = []
+    ranks = []
+    for counts in _all_counts(MAX_CARDS):
+        sums.append(sum([key * count for key, count in zip(SEVEN_CARD_KEYS, counts)]))
+        ranks.append(_rank_of_counts(counts))
+    if len(set(sums)) != len(sums):
+        raise ValueError('SEVEN_CARD_KEYS do not tell every 7 card hand apart')
+    table = np.zeros(max(sums) + 1, dtype=np.int32)
+    table[sums] = ranks
+    return table
+
+
+# The builders above only run the first time, STRAIGHT_HIGH first since the others use it
+_STRAIGHT_HIGH = cached_table('straight_high', TABLES_VERSION,
+                              lambda: [_straight_high(mask) for mask in range(1 << 13)])
+STRAIGHT_HIGH = _STRAIGHT_HIGH.tolist()
+_FLUSH_RANKS = cached_table('flush_ranks', TABLES_VERSION, lambda: [_flush_rank(mask) for mask in range(1 << 13)])
+FLUSH_RANKS = _FLUSH_RANKS.tolist()
+_product_table = cached_table('product_ranks', TABLES_VERSION, _product_ranks)
+PRODUCT_RANKS = dict(zip(*_product_table.tolist()))
+_SEVEN_CARD_RANKS = cached_table('seven_card_ranks', TABLES_VERSION, _seven_card_ranks)
+
+
+def evaluate(card_nums):
+    """
+    Rank a hand of up to 7 cards. With at most 7 cards, a hand that holds a flush can not also hold quads or a full
+    house, so a flushing suit settles the rank on its own.
+    :param card_nums: iterable of ints in range(52)
+    :return: int. Compare ranks directly: higher is better
+    """
+    product = 1
+    suit_masks = [0, 0, 0, 0]
+    for card_num in card_nums:
+        value = card_num >> 2
+        product *= PRIMES[value]
+        suit_masks[card_num & 3] |= 1 << value
+    for mask in suit_masks:
+        rank = FLUSH_RANKS[mask]
+        if rank:
+            return rank
+    return PRODUCT_RANKS[product]
+
+
+def category(rank):
+    """
+    :param rank: int. As returned by evaluate
+    :return: int. One of the category constants, e.g. FULL_HOUSE
+    """
+    return rank >> 20
+
+
+_CARD_PRIMES = np.array([PRIMES[card_num >> 2] for card_num in range(52)], dtype=np.int64)
+_CARD_BITS = np.array([1 << (13 * (card_num & 3) + (card_num >> 2)) for card_num in range(52)], dtype=np.int64)
+_SORTED_PRODUCT_RANKS = _product_table[:, _product_table[0].argsort()]
+_CARD_KEYS = np.array([SEVEN_CARD_KEYS[card_num >> 2] for card_num in range(52)], dtype=np.int64)
+
+
+def evaluate_batch(cards):
+    """
+    Rank many hands at once. Without a flush, 7 card hands are looked up directly by the sum of their
+    SEVEN_CARD_KEYS, and smaller hands by a binary search for the prime product of their values. The 52-bit mask of
+    the cards, 13 bits per suit, gives every suit's flush rank
+    :param cards: int array of shape (N, k), k <= 7. Each row is one hand of card_nums
+    :return: np.array of shape (N,)
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    if cards.shape[1] == MAX_CARDS:
+        ranks = _SEVEN_CARD_RANKS[_CARD_KEYS[cards].sum(axis=1)].astype(np.int64)
+    else:
+        products = _CARD_PRIMES[cards].prod(axis=1)
+        ranks = _SORTED_PRODUCT_RANKS[1][np.searchsorted(_SORTED_PRODUCT_RANKS[0], products)]
+    held = _CARD_BITS[cards].sum(axis=1)
+    for suit in range(4):
+        # A flush outranks anything else a hand of at most 7 cards can hold, and no flush ranks 0
+        ranks = np.maximum(ranks, _FLUSH_RANKS[held >> 13 * suit & 0x1FFF])
+    return ranks
+
+
+def showdown_batch(mine, yours):
+    """
+    Resolve many showdowns at once. Row i of mine plays row i of yours
+    :param mine: int array of shape (N, 7) of card_nums
+    :param yours: int array of shape (N, 7) of card_nums
+    :return: np.array of shape (N,). 1 if mine is higher, -1 if yours is higher, 0 if of the same strength
+    """
+    return np.sign(evaluate_batch(mine) - evaluate_batch(yours))
+
+
+if __name__ == '__main__':
+    from items import Hand
+    import time
+
+    n = 20000
+    deals = np.random.rand(n, 52).argsort(axis=1)[:, :9]
+    mine = np.hstack((deals[:, :2], deals[:, 4:]))
+    yours = deals[:, 2:]
+
+    start = time.time()
+    batch = showdown_batch(mine, yours)
+    batch_time = time.time() - start
+
+    start = time.time()
+    single = np.array([Hand.from_nums(a).showdown(Hand.from_nums(b)) for a, b in zip(mine, yours)])
+    single_time = time.time() - start
+
+    print 'Disagreements: {}/{}'.format(np.count_nonzero(batch != single), n)
+    print 'Batch: {:.0f} showdowns/s, Hand.showdown: {:.0f} showdowns/s'.format(n / batch_time, n / single_time)
@@ -0,0 +1,304 @@
+from items import *
+from equity import equity
+from cache import cached_table
+from canonical import canonical_suit_masks, preflop_index
+from collections import OrderedDict
+import numpy as np
+
+PREFLOP_TABLES_VERSION = 1
+PREFLOP_EQUITY_VERSION = 1  # bump with any change to build_preflop_equity's defaults
+
+
+class LRUCache:
+    """
+    Least recently used cache with hit and miss counters
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, compute, *args):
+        """
+        Look up key. On a miss, store and return compute(*args)
+        :param key: hashable
+        :param compute: function
+        :return: the cached value
+        """
+        try:
+            value = self._entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = compute(*args)
+            self.misses += 1
+            if len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+        self._entries[key] = value
+        return value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries.clear()
+
+
+BOARD_CACHE = LRUCache(1 << 12)
+HAND_CACHE = LRUCache(1 << 16)
+
+
+def _board_block(board):
+    masks = board.suit_masks()
+    return (made_hand_bools(masks), max([VALUE_COUNTS[mask] for mask in masks]),
+            tuple(sorted([card.value for card in board.cards], reverse=True)))
+
+
+def _hand_block(masks):
+    return made_hand_bools(masks), max([VALUE_COUNTS[mask] for mask in masks])
+
+
+def board_features(board):
+    """
+    The part of postflop_features that only depends on the board. It can be worked out once per street and passed to
+    postflop_features for every player
+    :param board: Hand
+    :return: (suit masks of the board, (board_bools, amount_of_one_suit_board, board_values))
+    """
+    masks = board.suit_masks()
+    return masks, BOARD_CACHE.get(canonical_suit_masks(masks), _board_block, board)
+
+
+def postflop_features(hand, board, street_features=None):
+    """
+    The parts of Player.decide's input that only depend on the cards. None of them depend on the suits' names, so both
+    blocks are cached by canonical_mask: the board block by the board's, so it is shared by every board that only
+    differs by suits, the combined block by that of hole cards plus board.
+    :param hand: Hand. The hole cards
+    :param board: Hand
+    :param street_features: board_features(board), if it was already worked out
+    :return: (amount_of_one_suit, amount_of_one_suit_board, bools, board_values). bools holds the 8 made hand bools of
+    hole cards plus board followed by the 8 of the board, board_values the board's values in descending order
+    """
+    board_masks, (board_bools, amount_of_one_suit_board, board_values) = street_features or board_features(board)
+    hole_masks = hand.suit_masks()
+    masks = [hole_masks[suit] | board_masks[suit] for suit in range(4)]
+    hand_bools, amount_of_one_suit = HAND_CACHE.get(canonical_suit_masks(masks), _hand_block, masks)
+    return amount_of_one_suit, amount_of_one_suit_board, list(hand_bools + board_bools), list(board_values)
+
+
+def cache_stats():
+    """
+    :return: dict. Hits, misses and hit rate of each feature cache
+    """
+    return dict((name, {'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hit_rate()})
+                for name, cache in (('board', BOARD_CACHE), ('hand', HAND_CACHE)))
+
+
+def _preflop_tables():
+    """
+    Classify every pair of hole cards into one of the 169 starting hands. Class high * 13 + low is suited,
+    low * 13 + high offsuit and value * 13 + value a pocket pair.
+    :return: (class of every pair of card_nums, shape (52, 52) with -1 on the diagonal,
+    [high_card, low_card, amount_of_one_suit, is_pair] of every class, shape (169, 4))
+    """
+    classes = np.zeros((52, 52), dtype=np.int64)
+    class_features = np.zeros((169, 4), dtype=np.int64)
+    for first in range(52):
+        for second in range(52):
+            if first == second:
+                classes[first, second] = -1
+                continue
+            high, low = max(first, second) >> 2, min(first, second) >> 2
+            suited = (first & 3) == (second & 3)
+            index = preflop_index((first, second))
+            classes[first, second] = index
+            class_features[index] = [high, low, 2 if suited else 1, int(high == low)]
+    return classes, class_features
+
+
+PREFLOP_CLASSES = cached_table('preflop_classes', PREFLOP_TABLES_VERSION, lambda: _preflop_tables()[0])
+PREFLOP_FEATURES = cached_table('preflop_features', PREFLOP_TABLES_VERSION, lambda: _preflop_tables()[1])
+_preflop_equity = None
+
+
+def preflop_class(hand):
+    """
+    :param hand: Hand. Two hole cards
+    :return: int in range(169)
+    """
+    return PREFLOP_CLASSES[hand.cards[0].card_num, hand.cards[1].card_num]
+
+
+def preflop_features(hand):
+    """
+    The card part of Player.decide's preflop input, by table lookup
+    :param hand: Hand. Two hole cards
+    :return: (high_card, low_card, amount_of_one_suit, is_pair)
+    """
+    return tuple(PREFLOP_FEATURES[preflop_class(hand)])
+
+
+def build_preflop_equity(samples=10000, seed=0):
+    """
+    Monte Carlo the heads up all-in equity of every starting hand against a random hand
+    :param samples: int. Runouts per starting hand
+    :param seed: int
+    :return: array of shape (169,). Win probability plus half the tie probability
+    """
+    rng = np.random.RandomState(seed)
+    table = np.zeros(169)
+    for index in range(169):
+        hole = np.argwhere(PREFLOP_CLASSES == index)[0]
+        table[index] = equity(hole, samples=samples, rng=rng)[0]
+    return table
+
+
+def preflop_equity(hand):
+    """
+    Heads up all-in equity against a random hand
+    :param hand: Hand. Two hole cards
+    :return: float
+    """
+    return preflop_equity_table()[preflop_class(hand)]
+
+
+def preflop_equity_table():
+    """
+    The equity of every starting hand class. Built the first time it is needed, then read from the cache
+    :return: array of shape (169,)
+    """
+    global _preflop_equity
+    if _preflop_equity is None:
+        _preflop_equity = cached_table('preflop_equity', PREFLOP_EQUITY_VERSION, build_preflop_equity)
+    return _preflop_equity
+
+
+_VALUE_COUNTS = np.array(VALUE_COUNTS)
+_STRAIGHTS = np.array(STRAIGHTS)
+
+
+def suit_mask_matrix(cards):
+    """
+    suit_masks of many sets of cards at once
+    :param cards: int array of shape (N, k). card_nums, no card twice in a row
+    :return: int64 array of shape (N, 4)
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    bits = 1 << (cards >> 2)
+    return np.vstack([np.where(cards & 3 == suit, bits, 0).sum(axis=1) for suit in range(4)]).T
+
+
+def made_hand_matrix(masks):
+    """
+    made_hand_bools of many sets of cards at once
+    :param masks: int array of shape (N, 4). As returned by suit_mask_matrix
+    :return: int array of shape (N, 8)
+    """
+    d, c, h, s = np.asarray(masks).T
+    two = d & c | d & h | d & s | c & h | c & s | h & s
+    three = d & c & (h | s) | h & s & (d | c)
+    four = d & c & h & s
+    pairs = two & ~three
+    trips = three & ~four
+    return np.vstack((pairs != 0,
+                      _VALUE_COUNTS[pairs] >= 2,
+                      trips != 0,
+                      _STRAIGHTS[d | c | h | s],
+                      (_VALUE_COUNTS[masks] >= 5).any(axis=1),
+                      (trips != 0) & (pairs != 0),
+                      four != 0,
+                      _STRAIGHTS[masks].any(axis=1))).T.astype(np.int64)
+
+
+def decision_matrix(hole, board, pushed, pot, call_up_to, stack, opponent_stack, dealer,
+                    with_preflop_equity=False):
+    """
+    The rows of x that Player.decide builds, without the decision, for many decision points on one street at once.
+    Amounts are in big blinds, as in decide
+    :param hole: int array of shape (N, 2). card_nums of the hole cards
+    :param board: int array of shape (N, board size). card_nums of the board, any order. Board size 0 preflop
+    :param pushed: array of shape (N,)
+    :param pot: array of shape (N,)
+    :param call_up_to: array of shape (N,)
+    :param stack: array of shape (N,)
+    :param opponent_stack: array of shape (N,)
+    :param dealer: array of shape (N,). 1 if the player is the dealer, else 0
+    :param with_preflop_equity: Bool. Append preflop_equity to the preflop rows, as decide does when
+    game.PREFLOP_EQUITY is set
+    :return: array of shape (N, 11) || (N, 12) preflop, (N, 27 + board size) after
+    """
+    hole = np.asarray(hole, dtype=np.int64)
+    board = np.asarray(board, dtype=np.int64).reshape(len(hole), -1)
+    board_size = board.shape[1]
+    if board_size == 0:
+        width = 12 if with_preflop_equity else 11
+    else:
+        width = 27 + board_size
+    x = np.zeros((len(hole), width))
+    x[:, 0] = 1
+    x[:, 1] = pushed
+    x[:, 2] = pot
+    x[:, 3] = call_up_to
+    x[:, 4] = stack
+    x[:, 5] = opponent_stack
+    x[:, 6] = dealer
+
+    classes = PREFLOP_CLASSES[hole[:, 0], hole[:, 1]]
+    high_card, low_card, amount_of_one_suit, is_pair = PREFLOP_FEATURES[classes].T
+    x[:, 8] = high_card
+    x[:, 9] = low_card
+    if board_size == 0:
+        x[:, 7] = amount_of_one_suit
+        x[:, 10] = is_pair
+        if with_preflop_equity:
+            x[:, 11] = preflop_equity_table()[classes]
+        return x
+
+    board_masks = suit_mask_matrix(board)
+    masks = board_masks | suit_mask_matrix(hole)
+    x[:, 7] = _VALUE_COUNTS[masks].max(axis=1)
+    x[:, 10] = _VALUE_COUNTS[board_masks].max(axis=1)
+    x[:, 11:19] = made_hand_matrix(masks)
+    x[:, 19:27] = made_hand_matrix(board_masks)
+    x[:, 27:] = np.sort(board >> 2, axis=1)[:, ::-1]
+    return x
+
+
+if __name__ == '__main__':
+    # decision_matrix against the rows Player.decide feeds the models, over a few thousand heads up hands. The
+    # players decide at random, so hands reach every street
+    import game
+    import time
+    cards = []
+    rows = []
+    decide = game.Player.decide
+    decision_parameter = game.decision_parameter
+
+    def recording_decide(player, call_up_to, opponent_stack):
+        board = player.game.board
+        cards.append((player.hand.card_nums(), board.card_nums() if board is not None else []))
+        return decide(player, call_up_to, opponent_stack)
+
+    def recording_decision_parameter(x, model, verbose=False):
+        rows.append(np.asarray(x[1:], dtype=np.float64))
+        return decision_parameter(x, model, verbose)
+    game.Player.decide = recording_decide
+    game.decision_parameter = recording_decision_parameter
+    game.load_models()
+    game.preflop_model = game.flop_model = game.turn_model = game.river_model = None
+    game.start_games(3000)
+
+    for board_size in (0, 3, 4, 5):
+        street = [i for i in range(len(rows)) if len(cards[i][1]) == board_size]
+        hole = np.array([cards[i][0] for i in street])
+        board = np.array([cards[i][1] for i in street]).reshape(len(street), board_size)
+        expected = np.array([rows[i] for i in street])
+        start = time.time()
+        x = decision_matrix(hole, board, *expected[:, 1:7].T, with_preflop_equity=game.PREFLOP_EQUITY)
+        elapsed = time.time() - start
+        assert np.array_equal(x, expected), board_size
+        print 'Board of {}: {} rows match decide ({:.0f} rows/s)'.format(board_size, len(street), len(street) / elapsed)
@@ -1,24 +1,49 @@
 from items import *
 from learning import *
+from features import *
 import random as rn
+import multiprocessing
+import time
+from equity import runout_ranks
 
 STARTING_AMOUNT = 500
 SB = 1.0
 BB = 2.0
 
-WATCH_AI = False
+WATCH_AI = False  # start_games seats WatchedPlayers, which print what they see and decide
 RANDOMNESS = 0.5
-preflop_model, flop_model, turn_model, river_model = load_all_models()
+PREFLOP_EQUITY = False  # Append the all-in equity vs a random hand to the preflop input. Preflop x is then 13 long
+PROFILE = False  # Time the phases of the game loop into PROFILER
+PROFILE_EVERY = 10000  # hands between reports while profiling
+preflop_model = flop_model = turn_model = river_model = None  # see load_models
+_models_loaded = False
+
+
+def load_models(reload=False):
+    """
+    Load the street models. This happens the first time a Table is made rather than at import, so importing game
+    stays cheap
+    :param reload: Bool. Load them again even if they were loaded before, e.g. after training
+    """
+    global preflop_model, flop_model, turn_model, river_model, _models_loaded
+    if reload or not _models_loaded:
+        preflop_model, flop_model, turn_model, river_model = load_all_models()
+        _models_loaded = True
+
 
 class Player:
     number_of_players = 0
 
-    def __init__(self, recorder=None, human=False):
+    def __init__(self, recorder=None):
         self._chips = STARTING_AMOUNT
-        self.human = human
         self.game = None
-        self.hand = None
+        self.hand = Hand([])  # dealt into in place every hand
+        self._inputs = {}  # length -> the reused input list of decide
+        self._filled = None  # the input whose card part is filled in for the current street
+        self._preflop = None  # (dealer, then preflop_features) for the current hand
         self._pushed = 0
+        self._committed = 0  # chips put into the pot this hand, for side pots
+        self.seat = None
         self.folded = False
         self.id = Player.number_of_players
         self.recorder = recorder
@@ -36,9 +61,14 @@ class Player:
         :param game: Game
         """
         self.game = game
-        self.hand = Hand(game.deck.draw(2))
+        self.hand.clear()
+        game.deck.deal_to(self.hand, 2)
+        self._filled = None
+        self._preflop = None
         self._pushed = 0
+        self._committed = 0
         self.folded = False
+        self.seat = len(game.players)
         game.players.append(self)
 
     def reset_chips(self):
@@ -62,6 +92,23 @@ class Player:
         self._chips -= bet_size
         self._pushed += bet_size
 
+    def committed(self):
+        return self._committed
+
+    def commit(self, amount):
+        """
+        Count chips that went from pushed into the pot, for side pots
+        :param amount: float
+        """
+        self._committed += amount
+
+    def is_dealer(self):
+        """
+        The dealer acts last after the flop
+        :return: Bool
+        """
+        return (self.seat - self.game.under_the_gun) % len(self.game.players) == len(self.game.players) - 1
+
     def collect(self, amount):
         """
         Simply adds money to the chips, and resets pushed. DOES NOT TAKE MONEY FROM ANYWHERE!
@@ -77,49 +124,31 @@ class Player:
         :return:
         """
         # Things we're allowed to know:
-        # everything in the Game, and the opponent's chip stack
-        opponent_stack = 0  # Gets overwritten
-        opponent_pushed = 0
-        for p in self.game.players:
-            if p.id != self.id:
-                opponent_stack = p.chips()
-                opponent_pushed = p.pushed()
-
-        if not self.human:
-            # This is the input to the net that produced the highest output.
-            decision = self.decide(call_up_to/BB, opponent_stack/BB)
-            if decision > 0:
-                chance = 0.9 + rn.random()/5
-                total_pot = call_up_to+self.pushed()*2+self.game.pot()
-                bet_size = max(call_up_to-self.pushed(), BB, int(total_pot*chance/3.))
-                if decision == 2:
-                    bet_size *= 3
-            else:
-                bet_size = decision
+        # everything in the Game, and the opponents' chip stacks
+        # This is the input to the net that produced the highest output.
+        decision = self.decide(call_up_to/BB, self.game.opponent_stack(self)/BB)
+        if decision > 0:
+            chance = 0.9 + rn.random()/5
+            total_pot = call_up_to+self._pushed*2+self.game.pot()
+            bet_size = max(call_up_to-self._pushed, BB, int(total_pot*chance/3.))
+            if decision == 2:
+                bet_size *= 3
         else:
-            print('Your chips: ${}'.format(self.chips()))
-            print("Computer's chips: ${}".format(opponent_stack))
-            print("You are the dealer: {}".format(not self.game.under_the_gun % 2))
-            print('Pot: ${}'.format(self.game.pot() + self.pushed() + opponent_pushed))
-            if self.game.board is not None:
-                print('Board: {}'.format(self.game.board.get_strings()))
-            else:
-                print('Pre-Flop')
-            print('Your hand: {}'.format(self.hand.get_strings()))
-            print('${} to call...'.format(call_up_to - self.pushed()))
-            bet_size = 0
-            try:
-                bet_size = int(raw_input("\tEnter a negative number to fold,\n"
-                                         "\tor a positive number to indicate\n"
-                                         "\thow much you'd like to raise by:\n\t"))
-            except ValueError:
-                pass
+            bet_size = decision
+        self.respond(call_up_to, bet_size)
+
+    def respond(self, call_up_to, bet_size):
+        """
+        Fold, call or raise
+        :param call_up_to: float. The total amount that needs to be pushed for a call
+        :param bet_size: float. Negative to fold, 0 to call, else the amount to raise by
+        """
         if bet_size < 0:  # Fold
             self.folded = True
         elif bet_size > 0:  # Raise
-            self.bet(call_up_to - self.pushed() + bet_size)
+            self.bet(call_up_to - self._pushed + bet_size)
         else:  # Call
-            self.bet(call_up_to - self.pushed())
+            self.bet(call_up_to - self._pushed)
 
     def decide(self, call_up_to, opponent_stack):
         """
@@ -137,231 +166,594 @@ class Player:
 
         :return: The decision parameter. -1: fold, 0: call/check, n>1: bet n*min_bet
         """
-        hand = self.hand.sort()  # Hand object (not for NN)
-        high_card = hand.cards[0].value
-        low_card = hand.cards[1].value
-        pushed = self.pushed() / BB
-        stack = self.chips() / BB
-        pot = self.game.pot()/BB
-        dealer = (self.id - self.game.under_the_gun) % 2
-        board = self.game.board
-
-
-        decision = None
-        if board is not None:
-            combined_hand = hand.plus(board)  # Hand object (not for NN)
-            amount_of_one_suit = max([len(combined_hand.get_values(suit)) for suit in Card.suits])
-            amount_of_one_suit_board = max([len(board.get_values(suit)) for suit in Card.suits])
-            board_values = [c.value for c in board.sort().cards]
-
-            bools = [
-                      int(bool(combined_hand.is_oak(2))),
-                      int(bool(combined_hand.is_two_pair())),
-                      int(bool(combined_hand.is_oak(3))),
-                      int(bool(combined_hand.is_straight())),
-                      int(bool(combined_hand.is_flush())),
-                      int(bool(combined_hand.is_full_house())),
-                      int(bool(combined_hand.is_oak(4))),
-                      int(bool(combined_hand.is_straight_flush())),
-                      int(bool(board.is_oak(2))),
-                      int(bool(board.is_two_pair())),
-                      int(bool(board.is_oak(3))),
-                      int(bool(board.is_straight())),
-                      int(bool(board.is_flush())),
-                      int(bool(board.is_full_house())),
-                      int(bool(board.is_oak(4))),
-                      int(bool(board.is_straight_flush()))
-                    ]
-            # bools = bools.reshape((len(bools),1))
-            # bools = np.matmul(bools, bools.T).flatten()
-            # bools = list(bools)
-            x = np.array([decision,
-                          1,  # for the intercept
-                          pushed,
-                          pot,
-                          call_up_to,
-                          stack,
-                          opponent_stack,
-                          dealer,
-                          amount_of_one_suit,
-                          high_card,
-                          low_card,
-                          amount_of_one_suit_board,
-                          ] + bools + board_values)
-        else:  # Preflop
-            board_values = []
-            amount_of_one_suit = max([len(hand.get_values(suit)) for suit in Card.suits])
-            x = np.array([decision,
-                          1,
-                          pushed,
-                          pot,
-                          call_up_to,
-                          stack,
-                          opponent_stack,
-                          dealer,
-                          amount_of_one_suit,
-                          high_card,
-                          low_card,
-                          int(bool(hand.is_oak(2)))
-                          ])
-        if WATCH_AI:
-            print '~\t{}'.format(x)
-            print "~\tHand: {}".format(self.hand.get_strings())
-
-        if len(board_values) == 0:  # PREFLOP
-            decision = decision_parameter(x, preflop_model, verbose=WATCH_AI)
-        elif len(board_values) == 3:  # FLOP
-            decision = decision_parameter(x, flop_model, verbose=WATCH_AI)
-        elif len(board_values) == 4:  # TURN
-            decision = decision_parameter(x, turn_model, verbose=WATCH_AI)
-        else:  # RIVER
-            decision = decision_parameter(x, river_model, verbose=WATCH_AI)
+        if PROFILE:
+            started = time.time()
+        game = self.game
+        pushed = self._pushed / BB
+        stack = self._chips / BB
+        pot = game.pot()/BB
+        board = game.board
+        board_size = board.size() if board is not None else 0
+        street = BOARD_SIZES.index(board_size)
+
+        # x is [decision, 1 (for the intercept), pushed, pot, call_up_to, stack, opponent_stack, dealer,
+        # amount_of_one_suit, high_card, low_card, then amount_of_one_suit_board, bools and board_values after the
+        # flop, is_pair and maybe the preflop equity before it]. It is filled in place, and copied when recorded. From
+        # dealer on it only depends on the cards and the seat, so it is filled once per street, and dealer to is_pair
+        # are worked out once per hand
+        length = 28 + board_size if board is not None else 13 if PREFLOP_EQUITY else 12
+        x = self._inputs.get(length) or self._input(length)
+        if self._filled is not x:
+            self._filled = x
+            hand = self.hand  # Hand object (not for NN)
+            if self._preflop is None:
+                self._preflop = (int(self.is_dealer()),) + preflop_features(hand)
+            dealer, high_card, low_card, amount_of_one_suit, is_pair = self._preflop
+            if board is not None:
+                features = postflop_features(hand, board, game.street_features())
+                amount_of_one_suit, amount_of_one_suit_board, bools, board_values = features
+                x[11] = amount_of_one_suit_board
+                x[12:28] = bools
+                x[28:] = board_values
+            else:  # Preflop
+                x[11] = is_pair
+                if PREFLOP_EQUITY:
+                    x[12] = preflop_equity(hand)
+            x[7] = dealer
+            x[8] = amount_of_one_suit
+            x[9] = high_card
+            x[10] = low_card
+        x[0] = 0
+        x[2] = pushed
+        x[3] = pot
+        x[4] = call_up_to
+        x[5] = stack
+        x[6] = opponent_stack
+        if PROFILE:
+            PROFILER.stop('features', started, street)
+            started = time.time()
+        decision = self.choose(x, street)
+        if PROFILE:
+            PROFILER.stop('inference', started, street)
         if call_up_to == pushed and decision == -1:
             decision = 0  # Don't fold when you can just call
         if self.recorder is not None:
             if rn.random() < RANDOMNESS:
-                decision = rn.randint(-1, 3)
-                if WATCH_AI:
-                    print('~\tOverriding w/ random decision: {}'.format(decision))
+                decision = self.explore()
             if call_up_to == pushed and decision == -1:
                 decision = 0  # Don't fold when you can just call
 
             x[0] = decision
-            self.recorder.x.append(x)
-            self.recorder.y_before.append(self.chips())
+            self.recorder.x.append(x[:])
+            self.recorder.y_before.append(self._chips)
+            self.recorder.streets.append(street)
         return decision
 
+    def choose(self, x, street, verbose=False):
+        """
+        Ask the street's model for a decision
+        :param x: list. The input built by decide
+        :param street: int. Index into BOARD_SIZES
+        :param verbose: Bool. See decision_parameter
+        :return: int. See decision_parameter
+        """
+        return decision_parameter(x, (preflop_model, flop_model, turn_model, river_model)[street], verbose=verbose)
+
+    def explore(self):
+        """
+        The random decision that replaces the model's for some of the recorded decisions, see RANDOMNESS
+        :return: int. See decision_parameter
+        """
+        return rn.randint(-1, 3)
+
+    def _input(self, length):
+        """
+        Make the input of decide for this length of x. It is kept and reused by the player
+        :param length: int
+        :return: list of length floats, with the intercept set
+        """
+        x = self._inputs[length] = [0] * length
+        x[1] = 1
+        return x
+
 
 class Game:
-    def __init__(self, utg):
-        self.deck = Deck()
+    def __init__(self, utg, rng=None):
+        self.deck = Deck(rng=rng)
         self._pot = 0
-        self.board = None
+        self._board = Hand([])  # dealt into in place every hand
+        self.board = None  # self._board once the flop is out
+        self._street_features = None  # see street_features
         self.players = []
+        self._top_player = None  # during a betting round, the player still in the hand with the largest stack
+        self._top_stack = 0
+        self._second_player = None  # and the one with the largest stack of the others
+        self._second_stack = 0
         self.under_the_gun = utg
         self.winner = None
+        self.showdown = False
+        self.betting_board_size = 0  # the size of the board when the last bet was made
+
+    def reset(self, utg):
+        """
+        Get ready for the next hand without building a new Game or Deck
+        :param utg: int. Index of the first player to act
+        """
+        self.deck.shuffle()
+        self._pot = 0
+        self._board.clear()
+        self.board = None
+        self._street_features = None
+        del self.players[:]
+        self.under_the_gun = utg
+        self.winner = None
+        self.showdown = False
+        self.betting_board_size = 0
+
+    def deal_board(self, num_of_cards):
+        """
+        Deal cards to the board
+        :param num_of_cards: int
+        """
+        self.deck.deal_to(self._board, num_of_cards)
+        self.board = self._board
+        self._street_features = None
+
+    def street_features(self):
+        """
+        board_features of the board, worked out once per street for every player
+        :return: see board_features
+        """
+        if self._street_features is None:
+            self._street_features = board_features(self.board)
+        return self._street_features
 
     def pot(self):
         return self._pot
 
     def collect_chips(self):
         """
-        The minimum amount that was pushed is what goes into the pot from both players. The rest goes back to the
-        player that pushed
+        Everything that was pushed goes into the pot, except the part of the largest bet that nobody matched. That goes
+        back to the player that pushed it
         :return: None
-        Modifies self.pot, player.pushed, player.chips
+        Modifies self.pot, player.pushed, player.chips, player.committed
         """
-        min_pushed = min([p.pushed() for p in self.players])
-        self._pot += min_pushed * len(self.players)
+        largest = second = 0
+        for p in self.players:
+            pushed = p.pushed()
+            if pushed > largest:
+                largest, second = pushed, largest
+            elif pushed > second:
+                second = pushed
+        uncalled = largest - second
         for p in self.players:
-            p.collect(p.pushed() - min_pushed)
+            pushed = p.pushed()
+            returned = uncalled if pushed == largest else 0
+            self._pot += pushed - returned
+            p.commit(pushed - returned)
+            p.collect(returned)
 
     def betting_round(self, stop_after):
         """
-        Allow players to .act() until they have pushed the same amount of chips into the pot.
+        Allow players to .act() in turn until everyone who can still bet has acted and pushed as much as the largest
+        bet. Players who folded or are all in are skipped. Before the flop the player after the big blind acts first,
+        after it the small blind.
         :return: None
         Calls self.collect_chips() and possibly modifies self.winner
         """
-        if self.board is not None and self.board.size() > stop_after:
+        board_size = self.board.size() if self.board is not None else 0
+        if board_size > stop_after:
             return
 
-        j = 0
-        while True:
-            if self.players[0].pushed() == self.players[1].pushed() and j >= len(self.players):
-                break
-            active_player_index = (self.under_the_gun + j) % len(self.players)
-            max_bet = max([p.pushed() for p in self.players])
-            active_player = self.players[active_player_index]
-            if active_player.chips() == 0:
-                break
+        players = self.players
+        max_bet = 0
+        live = 0
+        can_act = 0  # players that have not folded and are not all in
+        for p in players:
+            if p.pushed() > max_bet:
+                max_bet = p.pushed()
+            if not p.folded:
+                live += 1
+                if p.chips() > 0:
+                    can_act += 1
+        self._rank_stacks()
+        to_act = can_act  # of those, the ones that have not acted since the last raise
+        index = self.under_the_gun if self.board is not None else self.under_the_gun + 2
+        while to_act:
+            if can_act == 1 and self._matched(max_bet):
+                break  # nobody left to bet against
+            active_player = players[index % len(players)]
+            index += 1
+            stack = active_player.chips()
+            if active_player.folded or stack == 0:
+                continue
+            active_player.act(max_bet)
+            self.betting_board_size = board_size
+            # Only its stack went down, so the two largest only change if it held one of them
+            restack = active_player is self._top_player or active_player is self._second_player
+            if active_player.folded:
+                live -= 1
+                if live == 1:
+                    self.winner = self._second_player if active_player is self._top_player else self._top_player
+                    break
+                can_act -= 1
+                to_act -= 1
+                if restack:
+                    self._rank_stacks()
+                continue
+            chips = active_player.chips()
+            if restack and chips != stack:
+                self._restack(live)
+            if chips == 0:
+                can_act -= 1
+            pushed = active_player.pushed()
+            if pushed > max_bet:  # a raise: everyone else that can still bet has to act again
+                max_bet = pushed
+                to_act = can_act if chips == 0 else can_act - 1
             else:
-                active_player.act(max_bet)
+                to_act -= 1
+        self.collect_chips()
+
+    def _matched(self, max_bet):
+        """
+        :param max_bet: float. The largest amount pushed
+        :return: Bool. Everyone that can still bet has pushed max_bet
+        """
+        for p in self.players:
+            if not p.folded and p.chips() > 0 and p.pushed() != max_bet:
+                return False
+        return True
+
+    def _rank_stacks(self):
+        """
+        Find the two largest stacks of the players still in the hand, see opponent_stack
+        """
+        top_player = second_player = None
+        top_stack = second_stack = 0
+        for p in self.players:
+            if not p.folded:
+                chips = p.chips()
+                if top_player is None or chips > top_stack:
+                    second_player, second_stack = top_player, top_stack
+                    top_player, top_stack = p, chips
+                elif second_player is None or chips > second_stack:
+                    second_player, second_stack = p, chips
+        self._top_player = top_player
+        self._top_stack = top_stack
+        self._second_player = second_player
+        self._second_stack = second_stack
+
+    def _restack(self, live):
+        """
+        Keep the two largest stacks up to date after one of them went down
+        :param live: int. Number of players still in the hand
+        """
+        if live > 2:
+            self._rank_stacks()
+            return
+        # Only these two are left
+        top_player, second_player = self._top_player, self._second_player
+        if top_player.chips() < second_player.chips():
+            top_player, second_player = second_player, top_player
+        self._top_player = top_player
+        self._top_stack = top_player.chips()
+        self._second_player = second_player
+        self._second_stack = second_player.chips()
+
+    def opponent_stack(self, player):
+        """
+        The largest stack of the other players still in the hand, for a player acting in a betting round
+        :param player: Player
+        :return: float
+        """
+        return self._second_stack if player is self._top_player else self._top_stack
 
-            if self.players[0].folded:
-                self.winner = self.players[1]
+    def pay_out(self):
+        """
+        Pay the pot to the winner. At showdown, every live hand is ranked once and the pot is split into a main pot
+        and side pots by how much each live player committed. Each pot goes to the best hand among the players that
+        contributed to all of it, and ties split it.
+        :return: None
+        """
+        if self.winner is not None:
+            self.winner.collect(self._pot)
+            return
+        live = [p for p in self.players if not p.folded]
+        ranks = [p.get_hand().rank() for p in live]
+        levels = sorted(set([p.committed() for p in live]))
+        paid = 0
+        below = 0
+        for level in levels:
+            if level == levels[-1]:
+                pot = self._pot - paid  # includes anything folded players put in above every live player
+            else:
+                pot = sum([min(p.committed(), level) - min(p.committed(), below) for p in self.players])
+            best = max([rank for rank, p in zip(ranks, live) if p.committed() >= level])
+            winners = [p for rank, p in zip(ranks, live) if p.committed() >= level and rank == best]
+            for p in winners:
+                p.collect(pot / len(winners))
+            paid += pot
+            below = level
+
+    def expected_pay_out(self, rng=None):
+        """
+        What pay_out would pay each live player at showdown on average over every runout of the board as it was when
+        the last bet was made, instead of the runout that was dealt. Exact once only the turn and river are left to
+        deal, Monte Carlo'd before. The cards of every player are known, folded ones are dead
+        :param rng: np.random.RandomState. For the Monte Carlo. Defaults to the global numpy RNG
+        :return: dict. Player -> expected chips collected
+        """
+        live = [p for p in self.players if not p.folded]
+        dead = [card for p in self.players if p.folded for card in p.hand.cards]
+        ranks = runout_ranks([p.hand for p in live], self._board.cards[:self.betting_board_size], dead=dead,
+                             rng=rng)[0]
+        committed = np.array([p.committed() for p in live])
+        levels = sorted(set(committed))
+        collected = np.zeros(ranks.shape)
+        paid = 0
+        below = 0
+        for level in levels:
+            if level == levels[-1]:
+                pot = self._pot - paid
+            else:
+                pot = sum([min(p.committed(), level) - min(p.committed(), below) for p in self.players])
+            eligible = committed >= level
+            best = ranks[:, eligible].max(axis=1)
+            winners = (ranks == best[:, None]) & eligible
+            collected += pot * winners / winners.sum(axis=1)[:, None].astype(np.float64)
+            paid += pot
+            below = level
+        return dict(zip(live, collected.mean(axis=0)))
+
+
+
+class Table:
+    """
+    Headless engine for self-play with two or more players. One Game and its Deck are kept for the whole run and
+    reset between hands, and the streets run as a flat loop. The hole cards, the board and the players' decision inputs
+    are dealt and filled in place rather than built for every hand. Nothing in Table, Game or Player prints or reads
+    input: human play and watching the AI are the HumanPlayer and WatchedPlayer subclasses, seated by start_games.
+    """
+    STREET_DEALS = [0, 3, 1, 1]  # cards dealt to the board before each betting round
+
+    def __init__(self, players, stop_after=5, rng=None, ev_labels=False):
+        """
+        :param players: list of Players, in seat order
+        :param stop_after: int. No betting once the board has more cards than this
+        :param rng: random.Random. Deals the cards. Defaults to the global random module
+        :param ev_labels: Bool. Hands that go to showdown are labelled for the recorders with Game.expected_pay_out
+        instead of the chips actually won, which takes the luck of the runout out of the training targets
+        """
+        load_models()
+        self.players = players
+        self.stop_after = stop_after
+        self.game = Game(0, rng=rng)
+        self.ev_labels = ev_labels
+        self.ev_rng = np.random.RandomState(rng.getrandbits(32)) if rng is not None else None
+
+    def play_hand(self, j):
+        """
+        Play hand number j: blinds, up to four betting rounds, showdown and payout. Players' recorders are updated
+        :param j: int. Decides who posts which blind and acts first
+        :return: Game. The finished hand
+        """
+        if PROFILE:
+            hand_started = started = time.time()
+        players = self.players
+        game = self.game
+        for p in players:
+            if p.chips() == 0:  # someone went bust
+                for q in players:
+                    q.reset_chips()
                 break
-            elif self.players[1].folded:
-                self.winner = self.players[0]
+
+        game.reset(j)
+        for p in players:
+            p.new_hand(game)
+
+        # Blinds
+        game.players[j % len(players)].bet(SB)
+        game.players[(j + 1) % len(players)].bet(BB)
+        if PROFILE:
+            PROFILER.stop('deal', started)
+
+        for street, deal in enumerate(Table.STREET_DEALS):
+            if deal:
+                if PROFILE:
+                    started = time.time()
+                game.deal_board(deal)
+                if PROFILE:
+                    PROFILER.stop('deal', started, street)
+            if PROFILE:
+                started = time.time()
+            game.betting_round(self.stop_after)
+            if PROFILE:
+                PROFILER.stop('betting', started, street)
+            if game.winner is not None:
                 break
-            j += 1
-        self.collect_chips()
+        else:
+            if PROFILE:
+                started = time.time()
+            game.showdown = True
+        expected = None
+        if self.ev_labels and game.showdown and any([p.recorder is not None for p in players]):
+            expected = game.expected_pay_out(self.ev_rng)
+            before = dict((p, p.chips()) for p in players)
+        game.pay_out()
+        if PROFILE and game.showdown:
+            PROFILER.stop('showdown', started)
+
+        if PROFILE:
+            started = time.time()
+        for p in players:
+            if p.recorder is not None:
+                if expected is None:
+                    p.recorder.y_after = p.chips()
+                else:
+                    p.recorder.y_after = before[p] + expected.get(p, 0)
+                p.recorder.add_to_list()
+        if PROFILE:
+            PROFILER.stop('record', started)
+            PROFILER.stop('hand', hand_started)
+        return game
+
+    def play(self, n):
+        """
+        Play n hands
+        :param n: int
+        """
+        for j in range(n):
+            self.play_hand(j)
 
 
+class HumanPlayer(Player):
+    """
+    A player controlled from the keyboard
+    """
+    def act(self, call_up_to):
+        """
+        Show the table and ask for a fold, call or raise
+        :param call_up_to: float. The total amount that needs to be pushed for a call.
+        """
+        opponent_stack = 0  # The largest stack of an opponent still in the hand
+        opponent_pushed = 0
+        for p in self.game.players:
+            if p is not self:
+                opponent_pushed += p.pushed()
+                if not p.folded:
+                    opponent_stack = max(opponent_stack, p.chips())
+
+        print('Your chips: ${}'.format(self.chips()))
+        print("Computer's chips: ${}".format(opponent_stack))
+        print("You are the dealer: {}".format(self.is_dealer()))
+        print('Pot: ${}'.format(self.game.pot() + self.pushed() + opponent_pushed))
+        if self.game.board is not None:
+            print('Board: {}'.format(self.game.board.get_strings()))
+        else:
+            print('Pre-Flop')
+        print('Your hand: {}'.format(self.hand.get_strings()))
+        print('${} to call...'.format(call_up_to - self.pushed()))
+        bet_size = 0
+        try:
+            bet_size = int(raw_input("\tEnter a negative number to fold,\n"
+                                     "\tor a positive number to indicate\n"
+                                     "\thow much you'd like to raise by:\n\t"))
+        except ValueError:
+            pass
+        self.respond(call_up_to, bet_size)
+
+
+class WatchedPlayer(Player):
+    """
+    A computer player that prints its inputs and the model's outputs as it decides, see WATCH_AI
+    """
+    def choose(self, x, street, verbose=True):
+        print '~\t{}'.format(x)
+        print "~\tHand: {}".format(self.hand.get_strings())
+        return Player.choose(self, x, street, verbose=verbose)
+
+    def explore(self):
+        decision = Player.explore(self)
+        print('~\tOverriding w/ random decision: {}'.format(decision))
+        return decision
 
-def start_games(n, stop_after=5, save_data_name=False, human=False):
 
-    if not human and save_data_name:
-        player_1 = Player(recorder=Recorder(save_data_name))
+def start_games(n, stop_after=5, save_data_name=False, human=False, recorder=None, number_of_players=2,
+                ev_labels=False):
+    """
+    Play n hands between the computer (player 1) and either the computer or a human (the last player)
+    :param n: int. Number of hands
+    :param stop_after: int. No betting once the board has more cards than this
+    :param save_data_name: String. Record player 1's decisions and save them under this name
+    :param human: Bool. The last player is controlled from the keyboard
+    :param recorder: Recorder. Record player 1's decisions here instead. It is returned, not saved
+    :param number_of_players: int. Players at the table, e.g. 6 for 6-max
+    :param ev_labels: Bool. Label decisions with the expected result of showdowns, see Table
+    :return: Recorder || None
+    """
+    if recorder is None and not human and save_data_name:
+        recorder = Recorder(save_data_name)
+
+    computer = WatchedPlayer if WATCH_AI else Player
+    if recorder is not None and not human:
+        player_1 = computer(recorder=recorder)
     else:
         stop_after = 5
-        player_1 = Player()
-    player_2 = Player(human=human)
+        player_1 = computer()
+    others = [computer() for i in range(number_of_players - 2)]
+    player_2 = HumanPlayer() if human else computer()
+    table = Table([player_1] + others + [player_2], stop_after, ev_labels=ev_labels)
+    if PROFILE:
+        PROFILER.reset()
 
     for j in range(n):
         if human or j % 1000 == 999:
             print "Game {}/{}".format(j+1, n)
 
-        if player_1.chips() == 0 or player_2.chips() == 0:
-            player_1.reset_chips()
-            player_2.reset_chips()
-
-        this_game = Game(j)
-        player_1.new_hand(this_game)
-        player_2.new_hand(this_game)
-
-        # Blinds
-        sb_index = j % len(this_game.players)
-        bb_index = (j + 1) % len(this_game.players)
-        this_game.players[sb_index].bet(SB)
-        this_game.players[bb_index].bet(BB)
+        this_game = table.play_hand(j)
+        if PROFILE and j % PROFILE_EVERY == PROFILE_EVERY - 1:
+            print PROFILER.report()
 
-        this_game.betting_round(stop_after)
-
-        if this_game.winner is None:
-            flop = Hand(this_game.deck.draw(3))
-            this_game.board = flop
-
-            this_game.betting_round(stop_after)
-
-            if this_game.winner is None:
-                turn = Hand(this_game.deck.draw(1))
-                this_game.board = this_game.board.plus(turn)
-
-                this_game.betting_round(stop_after)
-
-                if this_game.winner is None:
-                    river = Hand(this_game.deck.draw(1))
-                    this_game.board = this_game.board.plus(river)
-
-                    this_game.betting_round(stop_after)
-
-                    if this_game.winner is None:
-                        result = player_1.get_hand().showdown(player_2.get_hand())
-                        if player_2.human:
-                            print 'Showdown: {}'.format(this_game.board.get_strings())
-                        if result == 1:
-                            this_game.winner = player_1
-                        elif result == -1:
-                            this_game.winner = player_2
-
-        if this_game.winner is not None:
-            this_game.winner.collect(this_game.pot())
-        else:
-            player_1.collect(this_game.pot() / 2)
-            player_2.collect(this_game.pot() / 2)
-
-        if player_2.human:
+        if human:
+            if this_game.showdown:
+                print 'Showdown: {}'.format(this_game.board.get_strings())
             print "End of game {}. Computer's hand was: {}".format(j + 1, player_1.hand.get_strings())
             print "Your chips: ${}".format(player_2.chips())
-            print "Computer's chips: ${}\n".format(player_1.chips())
-
-        if player_1.recorder is not None:
-            player_1.recorder.y_after = player_1.chips()
-            player_1.recorder.add_to_list()
+            print "Computer's chips: ${}\n".format(', '.join([str(p.chips()) for p in [player_1] + others]))
 
     # Done playing all the games
     if save_data_name and player_1.recorder is not None:
         player_1.recorder.save()
+    if PROFILE:
+        print PROFILER.report()
+    return player_1.recorder
+
+
+def _play_shard(args):
+    """
+    Worker for start_games_parallel. Plays one shard of games with its own seed, streaming into its own shard files
+    :param args: (n, stop_after, save_data_name, worker index, seed, number_of_players, ev_labels)
+    :return: int. Number of decisions recorded
+    """
+    n, stop_after, save_data_name, index, seed, number_of_players, ev_labels = args
+    rn.seed(seed)
+    np.random.seed(seed)
+    recorder = Recorder(save_data_name, resume=True, prefix='worker{:03d}'.format(index))
+    start_games(n, stop_after, recorder=recorder, number_of_players=number_of_players, ev_labels=ev_labels)
+    recorder.flush()
+    return recorder.count
+
+
+def start_games_parallel(n, save_data_name, stop_after=5, workers=None, seed=0, resume=False, number_of_players=2,
+                         ev_labels=False):
+    """
+    Self-play n games split across a pool of worker processes. Each worker writes its own shards of the data set,
+    which read back in worker order. The result only depends on n, stop_after, workers and seed.
+    :param n: int. Total number of games
+    :param save_data_name: String. Name of the data set
+    :param stop_after: int. See start_games
+    :param workers: int. Number of processes. Defaults to the number of cores
+    :param seed: int. Seeds the per-worker RNGs
+    :param resume: Bool. Add to the data set instead of replacing it
+    :param number_of_players: int. Players at each table
+    :param ev_labels: Bool. See start_games
+    :return: None
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if not resume:
+        Recorder(save_data_name)  # clear out old shards
+    seeder = rn.Random(seed)
+    shards = [(n // workers + (1 if i < n % workers else 0), stop_after, save_data_name, i, seeder.getrandbits(32),
+               number_of_players, ev_labels) for i in range(workers)]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        counts = pool.map(_play_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+    print "Saving " + str(sum(counts)) + " decisions."
 
 
 # def create_data(name, n=8000):
@@ -387,15 +779,16 @@ if __name__ == '__main__':
     WATCH_AI = False
     RANDOMNESS = 0.2
 
+    trainers = [OnlineTrainer(name) for name in STREETS]
     for i in range(1):
-        start_games(1000000, save_data_name="all_games")
+        start_games_parallel(1000000, save_data_name="all_games", seed=i, resume=i > 0)
 
-        train_model(PREFLOP_NAME, data_name="all_games")
-        train_model(FLOP_NAME, data_name="all_games")
-        train_model(TURN_NAME, data_name="all_games")
-        train_model(RIVER_NAME, data_name="all_games")
+        # Only the games just played are read, the trainers already hold everything before them
+        for trainer in trainers:
+            trainer.update_from("all_games")
+            trainer.save()
 
-        preflop_model, flop_model, turn_model, river_model = load_all_models()
+        load_models(reload=True)
 
     # WATCH_AI = True
     # start_games(5, human=True)
@@ -1,7 +1,10 @@
 import random as rn
+import numpy as np
+from evaluator import evaluate
 
 
-class Card:
+class Card(object):
+    __slots__ = ('card_num', 'value', '_suit')
     values = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
     bw_values = values[::-1]
     suits = ['D', 'C', 'H', 'S']
@@ -39,12 +42,109 @@ class Card:
         return 0
 
 
+CARDS = [Card(card_num) for card_num in range(52)]  # shared, read-only. Index by card_num
+
+
+def popcount(mask):
+    """
+    :param mask: int
+    :return: number of set bits
+    """
+    return bin(mask).count('1')
+
+
+def nums_to_mask(card_nums):
+    """
+    Encode cards as a 52-bit mask. Bit card_num is set for every card held
+    :param card_nums: iterable of ints
+    :return: int
+    """
+    mask = 0
+    for card_num in card_nums:
+        mask |= 1 << card_num
+    return mask
+
+
+def mask_to_nums(mask):
+    """
+    Decode a 52-bit card mask
+    :param mask: int
+    :return: list of card_nums in ascending order
+    """
+    return [card_num for card_num in range(52) if mask >> card_num & 1]
+
+
+def suit_masks(card_nums):
+    """
+    One 13-bit value mask per suit, in the order of Card.suits
+    :param card_nums: iterable of ints
+    :return: list of 4 ints
+    """
+    masks = [0, 0, 0, 0]
+    for card_num in card_nums:
+        masks[card_num & 3] |= 1 << (card_num >> 2)
+    return masks
+
+
+def _has_straight(mask):
+    """
+    :param mask: int. 13-bit value mask
+    :return: Bool. Whether five consecutive values are held, the ace also counting below the 2
+    """
+    mask = mask << 1 | mask >> 12  # bit 0 is the low ace
+    return bool(mask & mask >> 1 & mask >> 2 & mask >> 3 & mask >> 4)
+
+
+VALUE_COUNTS = [popcount(mask) for mask in range(1 << 13)]  # index by 13-bit value mask
+STRAIGHTS = [_has_straight(mask) for mask in range(1 << 13)]
+
+
+def made_hand_bools(masks):
+    """
+    Every made hand of a set of cards in one pass over its suit masks, with the same meaning as the Hand predicates:
+    is_oak(k) is true when some value is held exactly k times, and a full house needs a value held exactly three times
+    and another held exactly twice
+    :param masks: list of 4 ints. As returned by suit_masks
+    :return: tuple of 8 ints: pair, two pair, three of a kind, straight, flush, full house, four of a kind,
+    straight flush
+    """
+    d, c, h, s = masks
+    two = d & c | d & h | d & s | c & h | c & s | h & s  # values held at least twice
+    three = d & c & (h | s) | h & s & (d | c)
+    four = d & c & h & s
+    pairs = two & ~three
+    trips = three & ~four
+    return (int(pairs != 0),
+            int(VALUE_COUNTS[pairs] >= 2),
+            int(trips != 0),
+            int(STRAIGHTS[d | c | h | s]),
+            int(VALUE_COUNTS[d] >= 5 or VALUE_COUNTS[c] >= 5 or VALUE_COUNTS[h] >= 5 or VALUE_COUNTS[s] >= 5),
+            int(trips != 0 and pairs != 0),
+            int(four != 0),
+            int(STRAIGHTS[d] or STRAIGHTS[c] or STRAIGHTS[h] or STRAIGHTS[s]))
+
+
 class Deck:
-    def __init__(self):
-        self._cards = range(52)
-        rn.shuffle(self._cards)
+    def __init__(self, rng=None, seed=None, dead=None):
+        """
+        Cards are dealt lazily, with a partial Fisher-Yates shuffle: drawing k cards only does k swaps.
+        :param rng: random.Random. Where the randomness comes from. Defaults to the global random module
+        :param seed: int. Use a new random.Random(seed) instead
+        :param dead: list of card_nums that are left out of the deck
+        """
+        if seed is not None:
+            rng = rn.Random(seed)
+        self._rng = rn if rng is None else rng
+        dead_mask = nums_to_mask(dead or [])
+        self._cards = [card_num for card_num in range(52) if not dead_mask >> card_num & 1]
         self._top_card = 0  # Represents the index of the next card
 
+    def shuffle(self):
+        """
+        Put every drawn card back. The order the cards are left in does not matter, later draws are uniform anyway
+        """
+        self._top_card = 0
+
     def draw(self, num_of_cards=None):
         """
         Returns the next card as a Card or as a list of Cards if num_of_cards is not None
@@ -52,26 +152,121 @@ class Deck:
         :param num_of_cards: number of cards to remove from the deck
         :return: card objects
         """
+        cards = self._cards
+        random = self._rng.random
+        remaining = len(cards)
         start = self._top_card
-        end = self._top_card + num_of_cards
+        end = start + (1 if num_of_cards is None else num_of_cards)
+        for i in range(start, end):
+            j = i + int(random() * (remaining - i))
+            cards[i], cards[j] = cards[j], cards[i]
+        self._top_card = end
         if num_of_cards is not None:
-            self._top_card += num_of_cards
-            return [Card(card) for card in self._cards[start:end]]
-        else:
-            self._top_card += 1
-            return Card(self._cards[start])
+            return [CARDS[card] for card in cards[start:end]]
+        return CARDS[cards[start]]
+
+    def deal_to(self, hand, num_of_cards):
+        """
+        Draw cards straight into a Hand instead of into a new list. Takes the same cards as draw would
+        :param hand: Hand. Modified in place
+        :param num_of_cards: number of cards to remove from the deck
+        """
+        cards = self._cards
+        random = self._rng.random
+        remaining = len(cards)
+        add = hand.cards.append
+        mask = hand.mask
+        for i in range(self._top_card, self._top_card + num_of_cards):
+            j = i + int(random() * (remaining - i))
+            card = cards[j]
+            cards[j] = cards[i]
+            cards[i] = card
+            add(CARDS[card])
+            mask |= 1 << card
+        hand.mask = mask
+        self._top_card += num_of_cards
 
     def cards_remaining(self):
         """
         Counts the number of cards remaining
         :return: number of cards that have not been drawn
         """
-        return 52-self._top_card
+        return len(self._cards)-self._top_card
+
+    @staticmethod
+    def deal_many(n, num_of_cards, dead=None, rng=None):
+        """
+        Deal num_of_cards from each of n independently shuffled decks at once, for batch simulation
+        :param n: int. Number of decks
+        :param num_of_cards: int
+        :param dead: list of card_nums that are left out of every deck
+        :param rng: np.random.RandomState. Defaults to the global numpy RNG
+        :return: int array of shape (n, num_of_cards). Every row is in dealing order
+        """
+        rng = np.random if rng is None else rng
+        dead_mask = nums_to_mask(dead or [])
+        cards = np.array([card_num for card_num in range(52) if not dead_mask >> card_num & 1])
+        keys = rng.rand(n, len(cards))
+        if num_of_cards < len(cards):
+            chosen = keys.argpartition(num_of_cards, axis=1)[:, :num_of_cards]
+        else:
+            chosen = np.tile(np.arange(len(cards)), (n, 1))
+        # argpartition leaves the chosen cards in an order that depends on their position, so sort them by their keys
+        rows = np.arange(n)[:, None]
+        chosen = chosen[rows, keys[rows, chosen].argsort(axis=1)]
+        return cards[chosen]
+
 
+class Hand(object):
+    __slots__ = ('cards', 'mask')
 
-class Hand:
     def __init__(self, cards):
         self.cards = cards  # list of Card objects
+        self.mask = 0  # 52-bit mask of the card_nums held
+        for card in cards:
+            self.mask |= 1 << card.card_num
+
+    @staticmethod
+    def from_nums(card_nums):
+        """
+        Build a Hand from card numbers without allocating any Cards
+        :param card_nums: iterable of ints
+        :return: Hand
+        """
+        return Hand([CARDS[card_num] for card_num in card_nums])
+
+    def clear(self):
+        """
+        Remove every card in place, so the Hand can be reused for the next deal
+        """
+        del self.cards[:]
+        self.mask = 0
+
+    def card_nums(self):
+        """
+        :return: list of ints. The card_num of every card, in hand order
+        """
+        return [card.card_num for card in self.cards]
+
+    def suit_masks(self):
+        """
+        :return: list of 4 ints. The 13-bit value mask of each suit, in the order of Card.suits
+        """
+        return suit_masks(self.card_nums())
+
+    def max_suit_count(self):
+        """
+        :return: int. The number of cards held in the most common suit
+        """
+        return max([VALUE_COUNTS[mask] for mask in self.suit_masks()])
+
+    def made_hands(self):
+        """
+        All the made hand predicates at once, see made_hand_bools
+        :return: tuple of 8 ints: pair, two pair, three of a kind, straight, flush, full house, four of a kind,
+        straight flush
+        """
+        return made_hand_bools(self.suit_masks())
 
     def minus(self, that):
         """
@@ -79,7 +274,8 @@ class Hand:
         :param that: Hand
         :return: Hand
         """
-        return Hand([card for card in self.cards if card not in that.cards])
+        mask = that.mask
+        return Hand([card for card in self.cards if not mask >> card.card_num & 1])
 
     def plus(self, that):
         """
@@ -105,7 +301,7 @@ class Hand:
         """
         card_nums = [card.card_num for card in self.cards]
         card_nums.sort(reverse=True)
-        cards = [Card(c_num) for c_num in card_nums]
+        cards = [CARDS[c_num] for c_num in card_nums]
         if select is not None:
             return Hand(cards[:select])
         return Hand(cards)
@@ -229,115 +425,26 @@ class Hand:
                 return a
         return self.sort().cards[-1].relative_to(that.sort().cards[-1])
 
+    def rank(self):
+        """
+        Rank the Hand with the precomputed evaluator. Only meaningful for Hands of up to 7 cards
+        :return: int. Higher is better, equal ranks are of the same strength
+        """
+        return evaluate(self.card_nums())
+
     def showdown(self, that):
         """
         Compare the value of two Hands.
         :param that: Hand
         :return: 1 if self is higher, -1 if that is higher, 0 if Hands are of the same strength
         """
-        # Check straight flush
-        for suit in Card.suits:
-            mine = self.is_straight(suit)
-            yours = that.is_straight(suit)
-            if mine or yours:
-                if mine and not yours:
-                    return 1
-                elif not mine and yours:
-                    return -1
-                return mine.compare_kickers(yours)
-
-        # 4oak
-        mine = self.is_oak(4)
-        yours = that.is_oak(4)
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            a = mine[0].compare_kickers(yours[0])
-            if a:
-                return a
-            return mine[1].compare_kickers(yours[1])
-
-        # Full House
-        mine = self.is_full_house()
-        yours = that.is_full_house()
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            a = mine[0].compare_kickers(yours[0])
-            if a:
-                return a
-            return mine[1].compare_kickers(yours[1])
-
-        # Flush
-        mine = self.is_flush()
-        yours = that.is_flush()
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            return mine.compare_kickers(yours)
-
-        # Straight
-        mine = self.is_straight()
-        yours = that.is_straight()
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            return mine.compare_kickers(yours)
-
-        # 3oak
-        mine = self.is_oak(3)
-        yours = that.is_oak(3)
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            a = mine[0].compare_kickers(yours[0])
-            if a:
-                return a
-            return mine[1].compare_kickers(yours[1])
-
-        # 2pair
-        mine = self.is_two_pair()
-        yours = that.is_two_pair()
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            a = mine[0].compare_kickers(yours[0])
-            if a:
-                return a
-            b = mine[1].compare_kickers(yours[1])
-            if b:
-                return b
-            return mine[2].compare_kickers(yours[2])
-
-        # pair
-        mine = self.is_oak(2)
-        yours = that.is_oak(2)
-        if mine or yours:
-            if mine and not yours:
-                return 1
-            elif not mine and yours:
-                return -1
-            a = mine[0].compare_kickers(yours[0])
-            if a:
-                return a
-            return mine[1].compare_kickers(yours[1])
-
-        # High Card
-        mine = self.sort(5)
-        yours = that.sort(5)
-        return mine.compare_kickers(yours)
+        mine = self.rank()
+        yours = that.rank()
+        if mine > yours:
+            return 1
+        elif mine < yours:
+            return -1
+        return 0
 
 
 if __name__ == '__main__':
@@ -1,25 +1,131 @@
 import pickle
 import numpy as np
 import random as rn
+import os
+import json
+import shutil
+import time
+import multiprocessing
 
 PREFLOP_NAME = 'preflop'
 FLOP_NAME = 'flop'
 TURN_NAME = 'turn'
 RIVER_NAME = 'river'
+STREETS = [PREFLOP_NAME, FLOP_NAME, TURN_NAME, RIVER_NAME]
+BOARD_SIZES = [0, 3, 4, 5]  # cards on the board, by street
+
+DECISIONS = [-1, 0, 1, 2, 3]  # x[0]
+ACTION_NAMES = ['fold', 'call', 'raise_1', 'raise_2', 'raise_3']
+
+MAX_X_LENGTH = 33
+RECORD_WIDTH = 3 + MAX_X_LENGTH  # street, length of x, y, x
+
+# The entries of x built by Player.decide, decision first
+MADE_HAND_NAMES = ['pair', 'two_pair', 'three_of_a_kind', 'straight', 'flush', 'full_house', 'four_of_a_kind',
+                   'straight_flush']
+_X_START = ['decision', 'intercept', 'pushed', 'pot', 'call_up_to', 'stack', 'opponent_stack', 'dealer',
+            'amount_of_one_suit', 'high_card', 'low_card']
+FEATURE_NAMES = dict([(PREFLOP_NAME, _X_START + ['is_pair'])] + [
+    (street_name, _X_START + ['amount_of_one_suit_board'] + ['hand_' + made for made in MADE_HAND_NAMES] +
+     ['board_' + made for made in MADE_HAND_NAMES] + ['board_value_{}'.format(i) for i in range(board_size)])
+    for street_name, board_size in zip(STREETS[1:], BOARD_SIZES[1:])])
+OPTIONAL_FEATURE_NAMES = {PREFLOP_NAME: ['preflop_equity']}  # appended in this order, e.g. with game.PREFLOP_EQUITY
+
+MODEL_FORMAT_VERSION = 1
+MODEL_MAGIC = 'PYPOKER MODEL\n'
+MODEL_ALIGNMENT = 64  # the betas start at a multiple of this many bytes
+DATA_FORMAT_VERSION = 1
+BLOCK_ROWS = 1 << 16  # rows of X read at a time when accumulating X^T X, so memory does not grow with the data
 
 model_folder = './models/ordered_'
 data_folder = './data/ordered_'
 
 
-class Model():
+def feature_names(street_name, width=None):
+    """
+    :param street_name: String. One of STREETS
+    :param width: int. Length of x. Picks how many of the street's optional features are included
+    :return: list of Strings. The name of every entry of x, starting with 'decision'
+    """
+    names = FEATURE_NAMES[street_name]
+    if width is None:
+        return names
+    extended = names + OPTIONAL_FEATURE_NAMES.get(street_name, [])
+    if not len(names) <= width <= len(extended):
+        raise ValueError('x on the {} has length {} to {}, found {}'.format(
+            street_name, len(names), len(extended), width))
+    return extended[:width]
 
-    def __init__(self, name):
-        file = open(model_folder + name + '.pkl', 'rb')
 
-        all_models = pickle.load(file)
-        self.call_model = all_models[:,0]
-        self.raise_1_model = all_models[:,1]
-        self.raise_2_model = all_models[:,2]
+def save_model(path, betas, street_name, names):
+    """
+    Write a model file: a magic line, a one line JSON header and the betas as raw little-endian float64, starting at a
+    multiple of MODEL_ALIGNMENT bytes. The file is renamed into place once complete
+    :param path: String
+    :param betas: array of shape (len(names) - 1, 3)
+    :param street_name: String. One of STREETS
+    :param names: list of Strings. See feature_names
+    """
+    betas = np.ascontiguousarray(betas, dtype='<f8')
+    if betas.shape != (len(names) - 1, 3):
+        raise ValueError('Expected betas of shape {}, found {}'.format((len(names) - 1, 3), betas.shape))
+    header = json.dumps({'version': MODEL_FORMAT_VERSION, 'street': street_name, 'feature_names': names,
+                         'shape': list(betas.shape), 'dtype': '<f8'})
+    padding = -(len(MODEL_MAGIC) + len(header) + 1) % MODEL_ALIGNMENT
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MODEL_MAGIC + header + ' ' * padding + '\n')
+        betas.tofile(f)
+    os.rename(path + '.tmp', path)
+
+
+def read_model(path):
+    """
+    Memory-map a model file written by save_model, checking its header against the data
+    :param path: String
+    :return: (header dict, betas array). The betas are read-only and not copied
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MODEL_MAGIC)) != MODEL_MAGIC:
+            raise ValueError(path + ' is not a model file')
+        header = json.loads(f.readline())
+        offset = f.tell()
+    if header['version'] > MODEL_FORMAT_VERSION:
+        raise ValueError('{} has model format version {}, this code reads up to {}'.format(
+            path, header['version'], MODEL_FORMAT_VERSION))
+    shape = tuple(header['shape'])
+    if shape != (len(header['feature_names']) - 1, 3):
+        raise ValueError('{} holds betas of shape {} for {} features'.format(
+            path, shape, len(header['feature_names'])))
+    if os.path.getsize(path) != offset + 8 * shape[0] * shape[1]:
+        raise ValueError(path + ' is truncated')
+    betas = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=shape)
+    return header, np.asarray(betas)
+
+
+class Model():
+
+    def __init__(self, name, folder=None):
+        """
+        Load a street's model. Falls back to the older pickle files
+        :param name: String. One of STREETS
+        :param folder: String. Prefix of the model files. Defaults to model_folder
+        """
+        if folder is None:
+            folder = model_folder
+        path = folder + name + '.model'
+        if os.path.exists(path):
+            header, self.betas = read_model(path)  # (params, 3): call, raise_1, raise_2
+            if header['street'] != name:
+                raise ValueError('{} holds the {} model'.format(path, header['street']))
+            self.feature_names = header['feature_names']
+        else:
+            with open(folder + name + '.pkl', 'rb') as f:
+                self.betas = np.asarray(pickle.load(f), dtype=np.float64)
+            self.feature_names = feature_names(name, len(self.betas) + 1)
+        self.name = name
+        self.call_model = self.betas[:,0]
+        self.raise_1_model = self.betas[:,1]
+        self.raise_2_model = self.betas[:,2]
 
     def call(self, x):
         return np.dot(self.call_model, x)
@@ -33,95 +139,356 @@ class Model():
     def num_of_params(self):
         return len(self.call_model)
 
-
-def load_all_models():
+    def scores(self, x):
+        """
+        Score call, raise_1 and raise_2 for many decision points with one matrix product
+        :param x: array of shape (N, params) or (params,). Rows of x without the decision
+        :return: array of shape (N, 3) or (3,)
+        """
+        return np.dot(x, self.betas)
+
+    def decide_batch(self, x):
+        """
+        The best decision for many decision points at once. Folding always scores 0
+        :param x: array of shape (N, params). Rows of x without the decision
+        :return: int array of shape (N,) with values in {-1, 0, 1, 2}
+        """
+        scores = np.hstack((np.zeros((len(x), 1)), self.scores(x)))
+        return scores.argmax(axis=1) - 1  # ties go to the earlier decision, as in decision_parameter
+
+
+def load_all_models(folder=None):
     try:
-        preflop_model = Model(PREFLOP_NAME)
+        preflop_model = Model(PREFLOP_NAME, folder)
     except IOError:
         preflop_model = None
     try:
-        flop_model = Model(FLOP_NAME)
+        flop_model = Model(FLOP_NAME, folder)
     except IOError:
         flop_model = None
     try:
-        turn_model = Model(TURN_NAME)
+        turn_model = Model(TURN_NAME, folder)
     except IOError:
         turn_model = None
     try:
-        river_model = Model(RIVER_NAME)
+        river_model = Model(RIVER_NAME, folder)
     except IOError:
         river_model = None
     return preflop_model, flop_model, turn_model, river_model
 
-def get_beta(X, Y):
-    A = np.matmul(X.T, X)
-    U, S, VT = np.linalg.svd(A)
+def get_beta(X, Y, block_rows=BLOCK_ROWS):
+    """
+    Least squares fit of Y on X. X^T X and X^T Y are accumulated over blocks of rows, so X can be a memmap larger than
+    memory
+    :param X: array of shape (n, m)
+    :param Y: array of shape (n,)
+    :param block_rows: int
+    :return: array of shape (m, 1)
+    """
+    XTX = np.zeros((X.shape[1], X.shape[1]))
+    XTY = np.zeros(X.shape[1])
+    for start in range(0, len(X), block_rows):
+        x = np.asarray(X[start:start + block_rows])
+        XTX += np.matmul(x.T, x)
+        XTY += np.matmul(x.T, np.asarray(Y[start:start + block_rows]))
+    return solve_beta(XTX, XTY)
+
+
+def solve_beta(XTX, XTY):
+    """
+    Least squares from the sufficient statistics, with a pseudo-inverse of X^T X that drops singular values <= 1e-2
+    :param XTX: array of shape (m, m)
+    :param XTY: array of shape (m,)
+    :return: array of shape (m, 1)
+    """
+    U, S, VT = np.linalg.svd(XTX)
 
     l = np.count_nonzero(S > 1e-2)
     U = U[:,:l]
     S = S[:l]
     S_inv = 1./S
 
-    ret_val = np.matmul(U, np.diag(S_inv))
-    ret_val = np.matmul(ret_val, U.T)
-    ret_val = np.matmul(ret_val, X.T)
-    ret_val = np.matmul(ret_val, Y)
+    ret_val = np.matmul(U * S_inv, np.matmul(U.T, XTY))
     return ret_val.reshape((len(ret_val),1))
 
 
 
 
 
-def train_model(name, data_name=None):
-    if data_name is None:
-        data_name = name
-    print "Training: " + name
+def shard_paths(data_name):
+    """
+    :param data_name: String
+    :return: list of the data set's shard files, in the order they should be read
+    """
+    folder = data_folder + data_name
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith('.npy')]
+
+
+def _split_folder(data_name):
+    return data_folder + data_name + '_split'
 
-    pf_model, f_model, t_model, r_model = load_all_models()
-    if name == PREFLOP_NAME:
-        length_of_data = 12#pf_model.num_of_params()
-    elif name == FLOP_NAME:
-        length_of_data = 31#f_model.num_of_params()
-    elif name == TURN_NAME:
-        length_of_data = 32#t_model.num_of_params()
-    elif name == RIVER_NAME:
-        length_of_data = 33#r_model.num_of_params()
-
-    # Load data
-    try:
-        in_x = open(data_folder + 'x_' + data_name + '.pkl', 'rb')
-        in_y = open(data_folder + 'y_' + data_name + '.pkl', 'rb')
-    except IOError as e:
-        # print 'Using Alternate Data'
-        # in_x = open('./data/x_' + name + '.pkl', 'rb')
-        # in_y = open('./data/y_' + name + '.pkl', 'rb')
-        raise e
-    x_all, y_all = pickle.load(in_x), pickle.load(in_y)
 
-    x = np.array([xi for xi in x_all if len(xi) == length_of_data], dtype='float')
-    y = np.array([yi for xi, yi in zip(x_all,y_all) if len(xi) == length_of_data])
+def _split_file(street_name, decision, column):
+    return '{}_{}_{}.f64'.format(street_name, ACTION_NAMES[DECISIONS.index(decision)], column)
 
-    y = y - y.mean()
-    n, m = x.shape
-    assert n == y.size
 
-    x_call = np.array([xi[1:] for xi in x if xi[0] == 0])
-    y_call = np.array([yi for xi, yi in zip(x,y) if xi[0] == 0])
+def split_data(data_name):
+    """
+    Bring the pre-split copy of a data set up to date. For every street and decision, x (without the decision) and y
+    are kept as raw contiguous float64 files that can be opened with np.memmap. Rows are only ever appended: shards
+    that were already split are skipped, so this only does work for shards written since the last call. If a shard
+    that was split has disappeared (the data set was replaced), the split copy is rebuilt from scratch.
+    :param data_name: String
+    :return: dict. The manifest: the format version, the shards split so far, the length of x and the feature names
+    per street and the rows in every file
+    """
+    folder = _split_folder(data_name)
+    manifest_path = os.path.join(folder, 'manifest.json')
+    shards = [os.path.basename(path) for path in shard_paths(data_name)]
+    empty = {'version': DATA_FORMAT_VERSION, 'shards': [], 'widths': {}, 'features': {}, 'rows': {}}
+    manifest = empty
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if manifest.get('version') != DATA_FORMAT_VERSION or not set(manifest['shards']) <= set(shards):
+        manifest = empty
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    # Drop anything appended after the manifest was last written, e.g. by a run that crashed mid-shard
+    for file_name in os.listdir(folder):
+        if file_name.endswith('.f64'):
+            with open(os.path.join(folder, file_name), 'r+b') as f:
+                f.truncate(manifest['rows'].get(file_name, 0) * 8 * _columns(manifest, file_name))
+
+    for shard_name in [shard_name for shard_name in shards if shard_name not in manifest['shards']]:
+        shard = np.load(os.path.join(data_folder + data_name, shard_name), mmap_mode='r')
+        for street, street_name in enumerate(STREETS):
+            rows = shard[shard[:, 0] == street]
+            if len(rows) == 0:
+                continue
+            width = int(rows[0, 1])
+            if np.any(rows[:, 1] != width) or manifest['widths'].get(street_name, width) != width:
+                raise ValueError('Mixed lengths of x on the ' + street_name)
+            manifest['widths'][street_name] = width
+            manifest['features'][street_name] = feature_names(street_name, width)
+            for decision in DECISIONS:
+                selected = rows[rows[:, 3] == decision]
+                for column, values in (('x', selected[:, 4:3 + width]), ('y', selected[:, 2])):
+                    file_name = _split_file(street_name, decision, column)
+                    with open(os.path.join(folder, file_name), 'ab') as f:
+                        np.ascontiguousarray(values, dtype=np.float64).tofile(f)
+                    manifest['rows'][file_name] = manifest['rows'].get(file_name, 0) + len(selected)
+        manifest['shards'].append(shard_name)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.rename(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def _columns(manifest, file_name):
+    if file_name.endswith('_y.f64'):
+        return 1
+    return manifest['widths'].get(file_name.split('_')[0], 1) - 1
+
+
+def load_split(data_name, street_name):
+    """
+    Memory-map the pre-split decisions of one street, splitting any new shards first
+    :param data_name: String
+    :param street_name: String. One of STREETS
+    :return: (length of x, dict mapping each decision to (x, y)). x has shape (n, length of x - 1), y has shape (n,)
+    """
+    manifest = split_data(data_name)
+    if street_name not in manifest['widths']:
+        raise IOError('No {} data for {}'.format(street_name, data_name))
+    width = manifest['widths'][street_name]
+    folder = _split_folder(data_name)
+    data = {}
+    for decision in DECISIONS:
+        arrays = []
+        for column, shape in (('x', (width - 1,)), ('y', ())):
+            file_name = _split_file(street_name, decision, column)
+            n = manifest['rows'].get(file_name, 0)
+            if n:
+                arrays.append(np.memmap(os.path.join(folder, file_name), dtype=np.float64, mode='r',
+                                        shape=(n,) + shape))
+            else:
+                arrays.append(np.zeros((0,) + shape))
+        data[decision] = tuple(arrays)
+    return width, data
+
+
+def _block_statistics(args):
+    """
+    Worker for split_statistics. X^T X, X^T y and the column sums of X over rows start to stop of one decision's
+    split files, which it maps itself so that no data is sent between processes
+    :param args: (path of x, path of y, columns of x, start, stop)
+    :return: (array of shape (m, m), array of shape (m,), array of shape (m,))
+    """
+    x_path, y_path, m, start, stop = args
+    x = np.asarray(np.memmap(x_path, dtype=np.float64, mode='r', offset=start * m * 8, shape=(stop - start, m)))
+    y = np.asarray(np.memmap(y_path, dtype=np.float64, mode='r', offset=start * 8, shape=(stop - start,)))
+    return np.matmul(x.T, x), np.matmul(x.T, y), x.sum(axis=0)
 
-    x_raise_1 = np.array([xi[1:] for xi in x if xi[0] == 1])
-    y_raise_1 = np.array([yi for xi, yi in zip(x,y) if xi[0] == 1])
 
-    x_raise_2 = np.array([xi[1:] for xi in x if xi[0] == 2])
-    y_raise_2 = np.array([yi for xi, yi in zip(x,y) if xi[0] == 2])
+def split_statistics(data_name, street_name, workers=None, block_rows=BLOCK_ROWS):
+    """
+    The sufficient statistics of the call, raise_1 and raise_2 models of a street, accumulated over blocks of rows of
+    the split data set by a pool of processes. Memory use depends on block_rows and workers, not on the number of rows
+    :param data_name: String
+    :param street_name: String. One of STREETS
+    :param workers: int. Number of processes. Defaults to the number of cores
+    :param block_rows: int. Rows per block
+    :return: (length of x, number of decisions, sum of y over every decision of the street, dict mapping 0, 1 and 2
+    to (X^T X, X^T y, column sums of X))
+    """
+    width, data = load_split(data_name, street_name)
+    m = width - 1
+    folder = _split_folder(data_name)
+    tasks = []
+    for decision in (0, 1, 2):
+        rows = len(data[decision][1])
+        x_path = os.path.join(folder, _split_file(street_name, decision, 'x'))
+        y_path = os.path.join(folder, _split_file(street_name, decision, 'y'))
+        tasks += [(decision, (x_path, y_path, m, start, min(start + block_rows, rows)))
+                  for start in range(0, rows, block_rows)]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            blocks = pool.imap(_block_statistics, [args for decision, args in tasks])
+            statistics = _sum_blocks(m, [decision for decision, args in tasks], blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        statistics = _sum_blocks(m, [decision for decision, args in tasks],
+                                 (_block_statistics(args) for decision, args in tasks))
+
+    n = sum([len(y) for x, y in data.values()])
+    y_sum = sum([y.sum() for x, y in data.values()])
+    return width, n, y_sum, statistics
+
+
+def _sum_blocks(m, decisions, blocks):
+    statistics = dict((decision, (np.zeros((m, m)), np.zeros(m), np.zeros(m))) for decision in (0, 1, 2))
+    for decision, block in zip(decisions, blocks):
+        for total, part in zip(statistics[decision], block):
+            total += part
+    return statistics
+
+
+def train_model(name, data_name=None, workers=None):
+    """
+    Fit the call, raise_1 and raise_2 models of a street from a data set and save them to model_folder
+    :param name: String. One of STREETS
+    :param data_name: String. Defaults to name
+    :param workers: int. Processes accumulating the statistics, see split_statistics
+    """
+    if data_name is None:
+        data_name = name
+    print "Training: " + name
 
-    beta_call = get_beta(x_call, y_call)
-    beta_raise_1 = get_beta(x_raise_1, y_raise_1)
-    beta_raise_2 = get_beta(x_raise_2, y_raise_2)
+    width, n, y_sum, statistics = split_statistics(data_name, name, workers)
+    names = feature_names(name, width)
 
-    betas = np.hstack((beta_call, beta_raise_1, beta_raise_2))
+    # Center y on the mean over every decision of the street: X^T (y - mean) = X^T y - mean * column sums of X
+    y_mean = y_sum / n
+    betas = np.hstack([solve_beta(xtx, xty - y_mean * x_sum) for xtx, xty, x_sum in
+                       [statistics[decision] for decision in (0, 1, 2)]])
     print betas
-    file = open(model_folder + name + '.pkl', 'wb')
-    pickle.dump(betas, file)
+    save_model(model_folder + name + '.model', betas, name, names)
+
+
+class OnlineTrainer:
+    """
+    Incremental least squares for one street. Keeps the sufficient statistics X^T X, X^T y and the column sums of X
+    for the call, raise_1 and raise_2 models, plus the count and sum of y over every decision of the street (y is
+    centered on that mean, as in train_model). New rows are folded in as they arrive and the betas are re-solved from
+    the statistics alone, so history is never reprocessed.
+    """
+    def __init__(self, name):
+        """
+        :param name: String. One of STREETS
+        """
+        self.name = name
+        self.n = 0
+        self.y_sum = 0.
+        self.xtx = {}
+        self.xty = {}
+        self.x_sum = {}
+        self._rows_seen = {}  # (data_name, decision) -> rows already folded in
+
+    def update(self, x, y, decision):
+        """
+        Fold in a batch of decisions
+        :param x: array of shape (n, m). Rows of x without the decision
+        :param y: array of shape (n,)
+        :param decision: int. The decision taken in every row, one of DECISIONS
+        """
+        self.n += len(y)
+        self.y_sum += y.sum()
+        if decision not in (0, 1, 2):
+            return
+        if decision not in self.xtx:
+            m = x.shape[1]
+            self.xtx[decision] = np.zeros((m, m))
+            self.xty[decision] = np.zeros(m)
+            self.x_sum[decision] = np.zeros(m)
+        self.xtx[decision] += np.matmul(x.T, x)
+        self.xty[decision] += np.matmul(x.T, y)
+        self.x_sum[decision] += x.sum(axis=0)
+
+    def update_from(self, data_name):
+        """
+        Fold in every decision of this street that was added to a data set since the last call
+        :param data_name: String
+        :return: int. Number of new decisions
+        """
+        try:
+            width, data = load_split(data_name, self.name)
+        except IOError:
+            return 0
+        new = 0
+        for decision in DECISIONS:
+            x, y = data[decision]
+            seen = self._rows_seen.get((data_name, decision), 0)
+            if len(y) < seen:
+                raise ValueError(data_name + ' was replaced since it was last read. Use a new OnlineTrainer')
+            for start in range(seen, len(y), BLOCK_ROWS):
+                self.update(np.asarray(x[start:start + BLOCK_ROWS]), np.asarray(y[start:start + BLOCK_ROWS]), decision)
+            self._rows_seen[(data_name, decision)] = len(y)
+            new += len(y) - seen
+        return new
+
+    def betas(self):
+        """
+        :return: array of shape (m, 3). One column per model: call, raise_1, raise_2
+        """
+        y_mean = self.y_sum / self.n
+        return np.hstack([solve_beta(self.xtx[d], self.xty[d] - y_mean * self.x_sum[d]) for d in (0, 1, 2)])
+
+    def ready(self):
+        """
+        :return: Bool. Every model has seen data, so betas can be solved
+        """
+        return self.n > 0 and all([d in self.xtx for d in (0, 1, 2)])
+
+    def save(self, folder=None):
+        """
+        Solve and write the model file, as train_model does
+        :param folder: String. Prefix of the model file. Defaults to model_folder
+        """
+        if folder is None:
+            folder = model_folder
+        betas = self.betas()
+        save_model(folder + self.name + '.model', betas, self.name, feature_names(self.name, len(betas) + 1))
+        return betas
 
 
 def decision_parameter(x_data, model, verbose=False):
@@ -138,50 +505,159 @@ def decision_parameter(x_data, model, verbose=False):
             print('~\tUsing random decision: {}'.format(d))
         return d
 
-    x = np.copy(x_data)
-    x = x[1:]
-    x = x.reshape((len(x),1))
+    x = np.array(x_data[1:], dtype=np.float64)
 
     fold = 0
-    call = model.call(x)
-    raise_1 = model.raise_1(x)
-    raise_2 = model.raise_2(x)
-
-    params = [-1, 0, 1, 2]
-    actions = [fold, call, raise_1, raise_2]
+    call, raise_1, raise_2 = model.scores(x).tolist()
 
     if verbose:
-        print '~\t' + '\t'.join([str(a) for a in actions])
-    return params[actions.index(max(actions))]
+        print '~\t' + '\t'.join([str(a) for a in (fold, call, raise_1, raise_2)])
+    # The best scoring decision, ties going to the earlier one
+    if fold >= call and fold >= raise_1 and fold >= raise_2:
+        return -1
+    if call >= raise_1 and call >= raise_2:
+        return 0
+    return 1 if raise_1 >= raise_2 else 2
 
 
 class Recorder:
-    def __init__(self, name):
+    """
+    Streams decisions to disk as they complete. Every decision is one fixed-width row of
+    [street, length of x, y, x padded with zeros to MAX_X_LENGTH], where y is the chip delta of the hand (or its
+    expected value at showdown, with Table's ev_labels) divided by a pot estimate. Rows are buffered in a preallocated
+    block of chunk_size rows and written out as numbered .npy shards in data_folder + name, so memory stays bounded and
+    a crash loses at most one chunk.
+    """
+    def __init__(self, name, chunk_size=100000, resume=False, prefix='shard'):
+        """
+        :param name: String. Name of the data set. None keeps nothing on disk
+        :param chunk_size: int. Decisions per shard
+        :param resume: Bool. Add shards after the ones already on disk instead of replacing them
+        :param prefix: String. Shard file prefix. Writers sharing a data set need different prefixes
+        """
         self.name = name
-        self._x = []
-        self._y_before = []
-        self._y_after = []
+        self.prefix = prefix
+        self.count = 0  # decisions written or buffered
+        self._buffer = np.zeros((chunk_size, RECORD_WIDTH))
+        self._rows = 0
+        self._shard = 0
         self.x = []
         self.y_before = []
+        self.streets = []
         self.y_after = None
 
+        if name is not None:
+            folder = data_folder + name
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            for shard in shard_paths(name):
+                if not resume:
+                    os.remove(shard)
+                elif os.path.basename(shard).startswith(prefix + '_'):
+                    self._shard += 1
+            if not resume and os.path.isdir(_split_folder(name)):
+                # The new shards reuse the old names, so split_data could not tell that its copy is stale
+                shutil.rmtree(_split_folder(name))
+
     def save(self):
-        out_x = open(data_folder + 'x_' + self.name + '.pkl', 'wb')
-        out_y = open(data_folder + 'y_' + self.name + '.pkl', 'wb')
-        x = np.array(self._x)
-        pot = np.array([xi[2] for xi in x]) + np.array([xi[3] for xi in x])/2.0
-        pot[pot == 0] = 1
-        y = np.divide((np.array(self._y_after) - np.array(self._y_before)), pot)
-        print "Saving " + str(len(y)) + " decisions."
-        # y = y - y.mean()
-        pickle.dump(x, out_x)
-        pickle.dump(y, out_y)
+        """
+        Write out the decisions that have not been flushed yet
+        """
+        self.flush()
+        print "Saving " + str(self.count) + " decisions."
+
+    def flush(self):
+        """
+        Write the buffered rows as the next shard. The shard is renamed into place once complete
+        """
+        if self._rows == 0 or self.name is None:
+            return
+        path = os.path.join(data_folder + self.name, '{}_{:05d}.npy'.format(self.prefix, self._shard))
+        with open(path + '.tmp', 'wb') as out:
+            np.save(out, self._buffer[:self._rows])
+        os.rename(path + '.tmp', path)
+        self._shard += 1
+        self._rows = 0
+
+    def add_rows(self, rows):
+        """
+        Append rows that are already in the record layout and labelled, e.g. from simulator.Simulator
+        :param rows: array of shape (n, RECORD_WIDTH)
+        """
+        start = 0
+        while start < len(rows):
+            take = min(len(rows) - start, len(self._buffer) - self._rows)
+            self._buffer[self._rows:self._rows + take] = rows[start:start + take]
+            self._rows += take
+            self.count += take
+            start += take
+            if self._rows == len(self._buffer):
+                self.flush()
 
     def add_to_list(self):
-        for x, y_before in zip(self.x, self.y_before):
-            self._x.append(x)
-            self._y_before.append(y_before)
-            self._y_after.append(self.y_after)
+        """
+        The hand is over: label its decisions with self.y_after and move them into the buffer
+        """
+        for x, y_before, street in zip(self.x, self.y_before, self.streets):
+            pot = x[2] + x[3] / 2.0
+            if pot == 0:
+                pot = 1
+            row = self._buffer[self._rows]
+            row[:] = 0
+            row[0] = street
+            row[1] = len(x)
+            row[2] = (self.y_after - y_before) / pot
+            row[3:3 + len(x)] = x
+            self._rows += 1
+            self.count += 1
+            if self._rows == len(self._buffer):
+                self.flush()
         self.x = []
         self.y_before = []
+        self.streets = []
         self.y_after = None
+
+
+class Profiler:
+    """
+    Call counts and cumulative wall time per phase of the game loop, optionally split by street. Callers only touch it
+    behind a flag (game.PROFILE), so it costs nothing when profiling is off.
+    """
+    def __init__(self):
+        self.seconds = {}  # (phase, street) -> seconds
+        self.counts = {}  # (phase, street) -> calls
+
+    def stop(self, phase, started, street=None):
+        """
+        Add the time since started to a phase
+        :param phase: String
+        :param started: float. time.time() when the phase started
+        :param street: int || None. Index into STREETS
+        """
+        key = (phase, street)
+        self.seconds[key] = self.seconds.get(key, 0.) + time.time() - started
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset(self):
+        self.seconds.clear()
+        self.counts.clear()
+
+    def report(self, total_phase='hand'):
+        """
+        :param total_phase: String. Shares are given relative to the time spent in this phase
+        :return: String. One line per phase and street
+        """
+        total = sum(seconds for (phase, street), seconds in self.seconds.items() if phase == total_phase)
+        lines = ['{:<12}{:<10}{:>10}{:>10}{:>10}{:>8}'.format('phase', 'street', 'calls', 'seconds', 'us/call',
+                                                             'share')]
+        for key in sorted(self.seconds, key=lambda k: (k[0], -1 if k[1] is None else k[1])):
+            phase, street = key
+            seconds = self.seconds[key]
+            calls = self.counts[key]
+            lines.append('{:<12}{:<10}{:>10}{:>10.2f}{:>10.1f}{:>8}'.format(
+                phase, '' if street is None else STREETS[street], calls, seconds, 1e6 * seconds / calls,
+                '{:.1%}'.format(seconds / total) if total else ''))
+        return '\n'.join(lines)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,158 @@
+"""
+Self-play training with generation and fitting overlapped.
+
+Generator processes play with the Simulator and stream their decisions into a data set, one shard per batch of hands.
+Meanwhile the trainer, in the main process, folds every new shard into one OnlineTrainer per street. Once enough new
+decisions have arrived it solves the models and publishes them as the next generation: the four model files are
+written into their own numbered set under GENERATIONS_FOLDER and only then is the `current` pointer renamed into
+place, so a generator never sees half a generation. Generators check the pointer between batches and swap in the new
+models, so no core waits for the fit.
+"""
+from learning import *
+from simulator import Simulator
+import game
+import multiprocessing
+import os
+import random as rn
+import time
+
+GENERATIONS_FOLDER = './models/generations_'
+POLL_SECONDS = 0.5
+
+
+def generation_prefix(data_name, generation):
+    """
+    :return: String. Prefix of the model files of a generation, as taken by Model and OnlineTrainer.save
+    """
+    return os.path.join(GENERATIONS_FOLDER + data_name, '{:05d}_'.format(generation))
+
+
+def _pointer_path(data_name):
+    return os.path.join(GENERATIONS_FOLDER + data_name, 'current')
+
+
+def published_generation(data_name):
+    """
+    :param data_name: String
+    :return: int || None. The latest generation published for a data set
+    """
+    try:
+        with open(_pointer_path(data_name)) as f:
+            return int(f.read())
+    except IOError:
+        return None
+
+
+def publish(data_name, generation, trainers):
+    """
+    Write the models of every trainer that is ready as a new generation, then point generators at it
+    :param data_name: String
+    :param generation: int
+    :param trainers: list of OnlineTrainers
+    :return: list of Strings. The streets that were published. The others are played at random
+    """
+    folder = GENERATIONS_FOLDER + data_name
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    published = []
+    for trainer in trainers:
+        if trainer.ready():
+            trainer.save(generation_prefix(data_name, generation))
+            published.append(trainer.name)
+    path = _pointer_path(data_name)
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(generation))
+    os.rename(path + '.tmp', path)
+    return published
+
+
+def _generate(index, data_name, seed, tables, hands_per_batch, randomness, stop, hands_played):
+    """
+    Generator process. Plays batches of hands with the latest published models until stop is set
+    """
+    recorder = Recorder(data_name, resume=True, prefix='worker{:03d}'.format(index))
+    generation = published_generation(data_name)
+    if generation is None:
+        models = list(load_all_models())
+    else:
+        models = list(load_all_models(generation_prefix(data_name, generation)))
+    simulator = Simulator(tables, models=models, recorder=recorder, randomness=randomness, seed=seed)
+    while not stop.is_set():
+        latest = published_generation(data_name)
+        if latest != generation:
+            simulator.models = list(load_all_models(generation_prefix(data_name, latest)))
+            generation = latest
+        simulator.run(hands_per_batch)
+        recorder.flush()
+        with hands_played.get_lock():
+            hands_played.value += hands_per_batch
+
+
+def run_pipeline(data_name, generations=10, decisions_per_generation=500000, workers=None, tables=4096,
+                 hands_per_batch=20000, randomness=None, seed=0, resume=False):
+    """
+    Train by self-play, with generators playing while the trainer fits. The final models are also saved to
+    model_folder, where game loads them from
+    :param data_name: String. Name of the data set the generators write
+    :param generations: int. Number of model generations to publish
+    :param decisions_per_generation: int. New decisions the trainer waits for before each fit
+    :param workers: int. Number of generator processes. Defaults to the number of cores
+    :param tables: int. Tables per generator, see Simulator
+    :param hands_per_batch: int. Hands a generator plays between looking for new models. Each batch is one shard
+    :param randomness: float. Exploration of the recording seat. Defaults to game.RANDOMNESS
+    :param seed: int. Seeds the generators
+    :param resume: Bool. Keep the data set's existing decisions, which the trainers then start from
+    :return: list of OnlineTrainers
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if randomness is None:
+        randomness = game.RANDOMNESS
+    if not resume:
+        Recorder(data_name)  # clear out old shards
+        if os.path.exists(_pointer_path(data_name)):
+            os.remove(_pointer_path(data_name))  # start from the models in model_folder, not an old run's
+    seeder = rn.Random(seed)
+    stop = multiprocessing.Event()
+    hands_played = multiprocessing.Value('l', 0)
+    processes = [multiprocessing.Process(target=_generate, args=(i, data_name, seeder.getrandbits(32), tables,
+                                                                 hands_per_batch, randomness, stop, hands_played))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    trainers = [OnlineTrainer(name) for name in STREETS]
+    try:
+        started = time.time()
+        hands_before = 0
+        for generation in range(generations):
+            new = 0
+            while new < decisions_per_generation:
+                if not all([process.is_alive() for process in processes]):
+                    raise RuntimeError('A generator process died')
+                time.sleep(POLL_SECONDS)
+                new += sum([trainer.update_from(data_name) for trainer in trainers])
+
+            fit_started = time.time()
+            published = publish(data_name, generation, trainers)
+            now = time.time()
+            hands = hands_played.value
+            print 'Generation {}: {} new decisions, {} hands in {:.1f}s ({:.0f} hands/s), fit in {:.2f}s. ' \
+                  'Published: {}'.format(generation, new, hands - hands_before, now - started,
+                                         (hands - hands_before) / (now - started), now - fit_started,
+                                         ', '.join(published))
+            started = now
+            hands_before = hands
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+
+    for trainer in trainers:
+        if trainer.ready():
+            trainer.save()
+    return trainers
+
+
+if __name__ == '__main__':
+    run_pipeline('all_games', generations=20)
@@ -0,0 +1,257 @@
+"""
+Heads up self-play on thousands of tables at once.
+
+Every table is a row of NumPy state arrays (stacks, pushed, pot, cards, street, who is to act) and all tables are
+stepped in lockstep: each step closes the betting rounds that are over, then lets the player to act at every table
+act, with one Model.decide_batch call per street. The rules are those of Table.play_hand and Game.betting_round, and
+seat 0 plays the part of the recording player in start_games, so the rows it records are the same kind of training
+data as a Recorder fed by start_games.
+"""
+import game
+from game import STARTING_AMOUNT, SB, BB
+from items import Deck
+from learning import BOARD_SIZES, RECORD_WIDTH
+from features import decision_matrix
+from evaluator import showdown_batch
+import numpy as np
+
+BOARD_COLUMNS = [4, 5, 6, 7, 8]  # columns of Simulator.cards holding the board, in dealing order
+FLUSH_EVERY = 1 << 16  # pending rows that trigger labelling finished hands
+
+
+class Simulator:
+    def __init__(self, tables=4096, models=None, recorder=None, randomness=None, stop_after=5, seed=None):
+        """
+        :param tables: int. Number of tables played at once
+        :param models: list of four Models || None, one per street. Defaults to the models loaded by game. A None
+        model decides at random, like decision_parameter
+        :param recorder: Recorder. Seat 0's decisions are recorded here. Nothing is recorded if None
+        :param randomness: float. Probability that seat 0 explores with a random decision. Defaults to game.RANDOMNESS
+        :param stop_after: int. No betting once the board has more cards than this
+        :param seed: int. Seeds the cards, the bet sizes and the exploration
+        """
+        if models is None:
+            game.load_models()
+            models = [game.preflop_model, game.flop_model, game.turn_model, game.river_model]
+        self.models = models
+        self.recorder = recorder
+        self.randomness = game.RANDOMNESS if randomness is None else randomness
+        self.stop_after = stop_after
+        self.rng = np.random.RandomState(seed)
+
+        self.tables = tables
+        self.stacks = np.full((tables, 2), float(STARTING_AMOUNT))
+        self.pushed = np.zeros((tables, 2))
+        self.pot = np.zeros(tables)
+        self.cards = np.zeros((tables, 9), dtype=np.int64)  # seat 0's hole cards, seat 1's, then the board
+        self.street = np.zeros(tables, dtype=np.int64)  # index into BOARD_SIZES
+        self.acted = np.zeros(tables, dtype=np.int64)  # actions so far in the betting round, j in betting_round
+        self.hand_number = -np.ones(tables, dtype=np.int64)  # hands played at the table, j in start_games
+        self.hand_id = -np.ones(tables, dtype=np.int64)  # index of the hand being played, -1 once the table is done
+        self.winner = -np.ones(tables, dtype=np.int64)  # seat that won the hand, -1 if not decided yet
+
+        self.final_chips = np.zeros(0)
+        self._hands = 0
+        self._hands_started = 0
+        self._pending = []  # (rows with seat 0's chips before the decision in the label column, hand ids)
+
+    def run(self, n):
+        """
+        Play n hands, spread over the tables. Chips carry over from earlier calls
+        :param n: int
+        :return: array of shape (n,). Seat 0's chips at the end of each hand
+        """
+        self.final_chips = np.full(n, np.nan)
+        self._hands = n
+        self._hands_started = 0
+        self._start_hands(np.arange(self.tables))
+        while (self.hand_id >= 0).any():
+            self._close_rounds()
+            self._act()
+        self._label_pending()
+        return self.final_chips
+
+    def _start_hands(self, tables):
+        count = min(len(tables), self._hands - self._hands_started)
+        self.hand_id[tables[count:]] = -1
+        tables = tables[:count]
+        self.hand_id[tables] = np.arange(self._hands_started, self._hands_started + count)
+        self._hands_started += count
+
+        busted = tables[(self.stacks[tables] == 0).any(axis=1)]
+        self.stacks[busted] = STARTING_AMOUNT
+        self.hand_number[tables] += 1
+        self.cards[tables] = Deck.deal_many(count, 9, rng=self.rng)
+        self.pot[tables] = 0
+        self.pushed[tables] = 0
+        self.street[tables] = 0
+        self.acted[tables] = 0
+        self.winner[tables] = -1
+
+        # Blinds
+        self._bet(tables, self.hand_number[tables] % 2, SB)
+        self._bet(tables, (self.hand_number[tables] + 1) % 2, BB)
+
+    def _bet(self, tables, seats, amount):
+        """
+        Player.bet for one seat at each of many tables
+        """
+        bet_size = np.minimum(self.stacks[tables, seats], amount)
+        self.stacks[tables, seats] -= bet_size
+        self.pushed[tables, seats] += bet_size
+
+    def _round_over(self):
+        # Over once everyone who can still bet has acted and matched the largest bet, as in Game.betting_round
+        can_act = self.stacks > 0
+        matched = (self.pushed == self.pushed.max(axis=1)[:, None]) | ~can_act
+        over = matched.all(axis=1) & ((can_act.sum(axis=1) <= 1) | (self.acted >= 2))
+        over |= self.winner >= 0
+        over |= np.array(BOARD_SIZES)[self.street] > self.stop_after
+        return over & (self.hand_id >= 0)
+
+    def _close_rounds(self):
+        """
+        Collect the chips of every betting round that is over, then either go to the next street or finish the hand
+        and start the table's next one. Repeats until every table in play has a player to act
+        """
+        over = np.flatnonzero(self._round_over())
+        while len(over):
+            min_pushed = self.pushed[over].min(axis=1)
+            self.pot[over] += 2 * min_pushed
+            self.stacks[over] += self.pushed[over] - min_pushed[:, None]
+            self.pushed[over] = 0
+
+            finished = (self.winner[over] >= 0) | (self.street[over] == len(BOARD_SIZES) - 1)
+            self.street[over[~finished]] += 1
+            self.acted[over[~finished]] = 0
+            if finished.any():
+                self._finish_hands(over[finished])
+            over = np.flatnonzero(self._round_over())
+
+    def _finish_hands(self, tables):
+        showdown = tables[self.winner[tables] < 0]
+        if len(showdown):
+            board = self.cards[showdown][:, BOARD_COLUMNS]
+            result = showdown_batch(np.hstack((self.cards[showdown, :2], board)),
+                                    np.hstack((self.cards[showdown, 2:4], board)))
+            self.winner[showdown[result == 1]] = 0
+            self.winner[showdown[result == -1]] = 1
+
+        won = tables[self.winner[tables] >= 0]
+        self.stacks[won, self.winner[won]] += self.pot[won]
+        split = tables[self.winner[tables] < 0]
+        self.stacks[split] += self.pot[split, None] / 2
+        self.pot[tables] = 0
+
+        self.final_chips[self.hand_id[tables]] = self.stacks[tables, 0]
+        self._start_hands(tables)
+
+    def _act(self):
+        """
+        The player to act at every table in play calls, raises or folds
+        """
+        tables = np.flatnonzero(self.hand_id >= 0)
+        if not len(tables):
+            return
+        seat = (self.hand_number[tables] + self.acted[tables]) % 2
+        call_up_to = self.pushed[tables].max(axis=1)
+        pushed = self.pushed[tables, seat]
+        pot = self.pot[tables]
+
+        decisions = np.zeros(len(tables), dtype=np.int64)
+        for street in range(len(BOARD_SIZES)):
+            rows = np.flatnonzero(self.street[tables] == street)
+            if len(rows):
+                decisions[rows] = self._decide(tables[rows], seat[rows], street, call_up_to[rows])
+
+        chance = 0.9 + self.rng.rand(len(tables)) / 5
+        total_pot = call_up_to + pushed * 2 + pot
+        bet_size = np.maximum(np.maximum(call_up_to - pushed, BB), np.floor(total_pot * chance / 3.))
+        bet_size[decisions == 2] *= 3
+        amount = call_up_to - pushed + np.where(decisions > 0, bet_size, 0)
+
+        fold = decisions == -1
+        self.winner[tables[fold]] = 1 - seat[fold]
+        self._bet(tables[~fold], seat[~fold], amount[~fold])
+        self.acted[tables] += 1
+
+    def _features(self, tables, seat, street, call_up_to):
+        """
+        The rows of x that Player.decide builds, without the decision
+        :return: array of shape (len(tables), params)
+        """
+        hole = np.vstack((self.cards[tables, 2 * seat], self.cards[tables, 2 * seat + 1])).T
+        board = self.cards[tables][:, BOARD_COLUMNS[:BOARD_SIZES[street]]]
+        return decision_matrix(hole, board,
+                               self.pushed[tables, seat] / BB,
+                               self.pot[tables] / BB,
+                               call_up_to / BB,
+                               self.stacks[tables, seat] / BB,
+                               self.stacks[tables, 1 - seat] / BB,
+                               (seat - self.hand_number[tables]) % 2,
+                               with_preflop_equity=game.PREFLOP_EQUITY)
+
+    def _decide(self, tables, seat, street, call_up_to):
+        """
+        Decisions for tables that are all on the same street, recording seat 0's
+        :return: int array with values in {-1, 0, 1, 2, 3}
+        """
+        x = self._features(tables, seat, street, call_up_to)
+        model = self.models[street]
+        if model is None:
+            decisions = self.rng.randint(-1, 4, len(tables))
+        else:
+            decisions = model.decide_batch(x)
+        can_check = call_up_to == self.pushed[tables, seat]
+        decisions[can_check & (decisions == -1)] = 0  # Don't fold when you can just call
+
+        recorded = seat == 0
+        explore = recorded & (self.rng.rand(len(tables)) < self.randomness)
+        decisions[explore] = self.rng.randint(-1, 4, explore.sum())
+        decisions[can_check & (decisions == -1)] = 0
+
+        if self.recorder is not None and recorded.any():
+            rows = np.zeros((recorded.sum(), RECORD_WIDTH))
+            rows[:, 0] = street
+            rows[:, 1] = x.shape[1] + 1
+            rows[:, 2] = self.stacks[tables[recorded], 0]
+            rows[:, 3] = decisions[recorded]
+            rows[:, 4:4 + x.shape[1]] = x[recorded]
+            self._pending.append((rows, self.hand_id[tables[recorded]]))
+            if sum([len(hand_ids) for _, hand_ids in self._pending]) >= FLUSH_EVERY:
+                self._label_pending()
+        return decisions
+
+    def _label_pending(self):
+        """
+        Label the recorded rows of finished hands like Recorder.add_to_list and hand them to the recorder
+        """
+        if not self._pending:
+            return
+        rows = np.vstack([pending_rows for pending_rows, _ in self._pending])
+        ids = np.hstack([hand_ids for _, hand_ids in self._pending])
+        final_chips = self.final_chips[ids]
+        done = ~np.isnan(final_chips)
+
+        pot = rows[done, 5] + rows[done, 6] / 2.0
+        pot[pot == 0] = 1
+        rows[done, 2] = (final_chips[done] - rows[done, 2]) / pot
+        self.recorder.add_rows(rows[done])
+        self._pending = [(rows[~done], ids[~done])] if not done.all() else []
+
+
+if __name__ == '__main__':
+    import time
+    from learning import Recorder, load_split
+
+    recorder = Recorder('simulator_check', chunk_size=1 << 18)
+    simulator = Simulator(4096, recorder=recorder, seed=0)
+    start = time.time()
+    chips = simulator.run(200000)
+    elapsed = time.time() - start
+    recorder.save()
+    print '{} hands in {:.1f}s: {:.0f} hands/min'.format(len(chips), elapsed, len(chips) / elapsed * 60)
+    print 'Mean chips of seat 0 after a hand: {:.1f}'.format(chips.mean())
+    for name in ('preflop', 'flop', 'turn', 'river'):
+        width, data = load_split('simulator_check', name)
+        print name, width, dict((decision, len(y)) for decision, (x, y) in data.items())